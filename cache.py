@@ -0,0 +1,166 @@
+import hashlib
+import asyncio
+import random
+import time
+import os
+
+# Compiled solutions are kept in a persistent cache, so that judging an
+# unchanged solution again skips the compiler entirely. Entries are named after
+# a hash of everything that goes into the build and are evicted least recently
+# used first once the cache grows past its size limit; a hit touches the
+# entry's access time, which is what eviction orders by. (Not its modification
+# time, which Java's class data sharing checks the jar against.)
+#
+# The cache also holds precompiled headers (for C++, bits/stdc++.h), one per
+# compiler version and flag set, since parsing the header is most of the cost
+# of compiling a typical solution.
+
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+
+def cache_root():
+	base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+	return os.path.join(base, "veryfire")
+
+class CompileCache:
+
+	def __init__(self, directory=None, max_size=DEFAULT_MAX_SIZE):
+		self.directory = directory or cache_root()
+		self.compiled_dir = os.path.join(self.directory, "compiled")
+		self.header_dir = os.path.join(self.directory, "pch")
+		self.max_size = max_size
+		self.compiler_versions = {}
+		# toolchain hash -> future of the directory holding its precompiled
+		# header, so that concurrent compiles share one build
+		self.headers = {}
+
+	async def compiler_version(self, compiler):
+		# asked once per compiler, so that upgrading it invalidates old entries
+		if compiler not in self.compiler_versions:
+			try:
+				process = await asyncio.create_subprocess_exec(
+					compiler, "--version",
+					stdin=asyncio.subprocess.DEVNULL,
+					stdout=asyncio.subprocess.PIPE,
+					stderr=asyncio.subprocess.STDOUT,
+				)
+				version, _ = await process.communicate()
+			except OSError:
+				version = b""
+			self.compiler_versions[compiler] = version
+		return self.compiler_versions[compiler]
+
+	async def toolchain(self, language):
+		digest = hashlib.sha256()
+		digest.update(language.key.encode())
+		digest.update(b"\0" + await self.compiler_version(language.compiler))
+		for flag in language.flags:
+			digest.update(b"\0" + flag.encode())
+		return digest
+
+	async def key(self, language, filename):
+		# only the solution file itself is hashed; local headers it includes
+		# aren't tracked. Its name is, since Java derives class names from it.
+		digest = await self.toolchain(language)
+		digest.update(b"\0" + os.path.basename(filename).encode())
+		with open(filename, "rb") as file:
+			digest.update(b"\0" + file.read())
+		return digest.hexdigest()
+
+	def entry(self, key):
+		return os.path.join(self.compiled_dir, key)
+
+	def lookup(self, key):
+		path = self.entry(key)
+		try:
+			os.utime(path, (time.time(), os.stat(path).st_mtime))
+		except FileNotFoundError:
+			return None
+		return path
+
+	def staging_file(self, key):
+		os.makedirs(self.compiled_dir, exist_ok=True)
+		return staging_name(self.entry(key))
+
+	def store(self, key, staging_file):
+		path = self.entry(key)
+		os.replace(staging_file, path)
+		self.evict(keep=path)
+		return path
+
+	def evict(self, keep=None):
+		entries = []
+		total_size = 0
+		with os.scandir(self.compiled_dir) as it:
+			for entry in it:
+				if ".tmp" in entry.name or not entry.is_file():
+					continue
+				stat = entry.stat()
+				entries.append((stat.st_atime, stat.st_size, entry.path))
+				total_size += stat.st_size
+
+		entries.sort()
+		for _, size, path in entries:
+			if total_size <= self.max_size:
+				break
+			if path == keep:
+				continue
+			try:
+				os.remove(path)
+			except FileNotFoundError:
+				pass
+			total_size -= size
+
+	async def precompiled_header(self, language, filename):
+		# Returns a directory to add to the include path for the solution to
+		# pick up the precompiled header, or None if it doesn't include the
+		# header or it couldn't be built.
+		with open(filename, "rb") as file:
+			if language.precompiled_header.encode() not in file.read():
+				return None
+
+		key = (await self.toolchain(language)).hexdigest()
+		if key not in self.headers:
+			self.headers[key] = asyncio.ensure_future(self.build_header(language, os.path.join(self.header_dir, key)))
+		return await asyncio.shield(self.headers[key])
+
+	async def build_header(self, language, header_dir):
+		header = os.path.join(header_dir, language.precompiled_header)
+		if os.path.exists(header + ".gch"):
+			return header_dir
+
+		# The precompiled header is built from a stand-in for the real one,
+		# which is also what the compiler falls back to if it rejects the
+		# precompiled header (say, because the flags changed).
+		os.makedirs(os.path.dirname(header), exist_ok=True)
+		staging_file = staging_name(header)
+		with open(staging_file, "w") as file:
+			file.write("#include_next <" + language.precompiled_header + ">\n")
+		os.replace(staging_file, header)
+
+		staging_file = staging_name(header + ".gch")
+		try:
+			process = await asyncio.create_subprocess_exec(
+				*language.precompile_command(header, staging_file),
+				stdin=asyncio.subprocess.DEVNULL,
+				stdout=asyncio.subprocess.DEVNULL,
+				stderr=asyncio.subprocess.DEVNULL,
+			)
+			await process.wait()
+		except OSError:
+			return None
+
+		if process.returncode != 0:
+			try:
+				os.remove(staging_file)
+			except FileNotFoundError:
+				pass
+			return None
+
+		os.replace(staging_file, header + ".gch")
+		return header_dir
+
+def staging_name(path):
+	# compilers write their output in place, so they build into a private
+	# file that is then renamed over the real one in one step; other instances
+	# never see a half-written file
+	return path + ".tmp" + str(random.randint(0, 1_000_000_000))
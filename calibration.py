@@ -0,0 +1,99 @@
+from engine import Limits
+from judge import Verdict
+from cache import cache_root
+import statistics
+import asyncio
+import shutil
+import json
+import tmp
+import os
+
+# Measures how long each language takes to start up (interpreter or JVM boot,
+# dynamic linking) by running a program that does nothing a few times, so
+# that it can be told apart from the time a solution actually spends. The
+# medians are kept in a file, per language and toolchain, so this happens once.
+
+CALIBRATION_RUNS = 7
+
+class Overhead:
+
+	def __init__(self, cpu_time, wall_time):
+		# in seconds, the median of the calibration runs
+		self.cpu_time = cpu_time
+		self.wall_time = wall_time
+
+	def time(self, cpu_time):
+		# the overhead matching the kind of time the time limit applies to
+		return self.cpu_time if cpu_time else self.wall_time
+
+class Calibration:
+
+	def __init__(self, path=None):
+		self.path = path or os.path.join(cache_root(), "calibration.json")
+		self.measured = None
+		# key -> future of its overhead, so concurrent requests share the runs
+		self.pending = {}
+
+	def key(self, language):
+		# recalibrate when the toolchain changes
+		tool = shutil.which(language.compiler or language.run_command("")[0])
+		try:
+			version = str(os.stat(tool).st_mtime_ns)
+		except (OSError, TypeError):
+			version = ""
+		return language.key + ":" + str(tool) + ":" + version
+
+	def load(self):
+		if self.measured is None:
+			try:
+				with open(self.path, "r") as file:
+					self.measured = json.load(file)
+			except (OSError, ValueError):
+				self.measured = {}
+		return self.measured
+
+	def save(self):
+		os.makedirs(os.path.dirname(self.path), exist_ok=True)
+		staging_file = self.path + ".tmp" + str(os.getpid())
+		with open(staging_file, "w") as file:
+			json.dump(self.measured, file, indent="\t")
+		os.replace(staging_file, self.path)
+
+	async def overhead(self, engine, language):
+		# Returns the language's Overhead, or None if the empty program
+		# couldn't be run.
+		key = self.key(language)
+		measured = self.load()
+		if key in measured:
+			return Overhead(measured[key]["cpu"], measured[key]["wall"])
+
+		if key not in self.pending:
+			self.pending[key] = asyncio.ensure_future(self.calibrate(engine, language))
+		overhead = await asyncio.shield(self.pending[key])
+		if overhead is not None:
+			measured[key] = {"cpu": overhead.cpu_time, "wall": overhead.wall_time}
+			self.save()
+		return overhead
+
+	async def calibrate(self, engine, language):
+		directory = os.path.dirname(tmp.mktmp("calibration"))
+		source_file = os.path.join(directory, "Main" + language.extension)
+		with open(source_file, "w") as file:
+			file.write(language.empty_program)
+		input_file = os.path.join(directory, "empty.in")
+		open(input_file, "w").close()
+
+		compiled = await engine.compile(language, source_file)
+		if not compiled.success:
+			return None
+
+		cpu_times = []
+		wall_times = []
+		for i in range(CALIBRATION_RUNS):
+			result = await engine.run(language, compiled.output, input_file, Limits(10))
+			if result.verdict != Verdict.ACCEPTED:
+				return None
+			cpu_times.append(result.user_time + result.system_time)
+			wall_times.append(result.wall_time)
+
+		return Overhead(statistics.median(cpu_times), statistics.median(wall_times))
@@ -0,0 +1,61 @@
+from cache import cache_root
+import json
+import time
+import os
+
+# What find_cases() (see judge.py) found in each directory it searched, kept
+# between runs along with the directory's modification time. Adding, removing
+# or renaming an entry changes the modification time of the directory holding
+# it, so a directory with the same one as last time can be taken as is, which
+# leaves one stat() per directory where listing it took one per entry.
+
+# directories changed this recently (in nanoseconds) aren't remembered, since
+# on file systems with coarse timestamps they could change again without
+# their modification time moving
+SETTLE_TIME = 1_000_000_000
+
+class CaseIndex:
+
+	def __init__(self, path=None):
+		self.path = path or os.path.join(cache_root(), "cases.json")
+		# directory -> [modification time, subdirectory names, case file names]
+		self.directories = None
+		# modification times seen by lookup(), for store() to record
+		self.mtimes = {}
+		self.changed = False
+
+	def load(self):
+		if self.directories is None:
+			try:
+				with open(self.path, "r") as file:
+					self.directories = json.load(file)
+			except (OSError, ValueError):
+				self.directories = {}
+		return self.directories
+
+	def save(self):
+		if not self.changed:
+			return
+		os.makedirs(os.path.dirname(self.path), exist_ok=True)
+		staging_file = self.path + ".tmp" + str(os.getpid())
+		with open(staging_file, "w") as file:
+			json.dump(self.directories, file)
+		os.replace(staging_file, self.path)
+		self.changed = False
+
+	def lookup(self, directory):
+		# Returns (subdirectory names, [(input name, output name)]) as last
+		# found in the directory, or None if it changed since.
+		mtime = os.stat(directory).st_mtime_ns
+		self.mtimes[directory] = mtime
+		entry = self.load().get(directory)
+		if entry is None or entry[0] != mtime:
+			return None
+		return entry[1], [tuple(case) for case in entry[2]]
+
+	def store(self, directory, subdirs, cases):
+		mtime = self.mtimes.pop(directory)
+		if time.time_ns() - mtime < SETTLE_TIME:
+			return
+		self.load()[directory] = [mtime, subdirs, cases]
+		self.changed = True
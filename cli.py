@@ -0,0 +1,241 @@
+from judge import languages, checkers, find_cases, Verdict, verdict_names
+from engine import Engine, Limits
+from cache import CompileCache
+from calibration import Calibration
+from stats import Benchmark, Headroom
+from resultcache import ResultCache
+from history import History
+from caseindex import CaseIndex
+from prefetch import Prefetcher, PREFETCH_DEPTH
+import argparse
+import tmp
+import asyncio
+import json
+import math
+import sys
+import os
+
+# Headless entry point. Nothing in here (or in judge.py) may import PyQt5, so
+# that judging works on machines without a display and starts up quickly.
+
+def find_language(key, solution_path):
+	for language in languages:
+		if key is not None and language.key == key:
+			return language
+		if key is None and solution_path.endswith(language.extension):
+			return language
+	return None
+
+def megabytes(value):
+	# 0 stands for no limit
+	return value * 1024 * 1024 if value > 0 else None
+
+def positive_int(value):
+	# 0 jobs would never run anything
+	number = int(value)
+	if number < 1:
+		raise argparse.ArgumentTypeError("must be at least 1")
+	return number
+
+def find_checker(key):
+	for checker in checkers:
+		if checker.key == key:
+			return checker
+	return None
+
+async def run_test(engine, language, compiled_file, test, limits, checker, args):
+	# returns the result to report, and the Benchmark it was picked from in
+	# benchmark mode
+	benchmark = None
+	if args.runs > 1:
+		results = await engine.benchmark(language, compiled_file, test[0], limits, args.runs, warmup_runs=args.warmup, start_check=lambda: checker.start(test[1]), spool=args.spool)
+		benchmark = Benchmark(results, limits)
+		result = benchmark.result()
+	else:
+		result = await engine.judge(language, compiled_file, test, limits, checker, spool=args.spool, jit_probe=args.jit_probe)
+	if result.output_file is not None:
+		os.remove(result.output_file)
+	return result, benchmark
+
+async def judge(args):
+	solution_path = os.path.abspath(args.solution)
+
+	if not os.path.isfile(solution_path):
+		print("error: no file was found at the provided path to the solution file", file=sys.stderr)
+		return 2
+
+	if not os.path.isdir(args.data):
+		print("error: the provided path to the data directory doesn't name a directory", file=sys.stderr)
+		return 2
+
+	language = find_language(args.language, solution_path)
+	if language is None:
+		print("error: couldn't determine the language of the solution, use --language", file=sys.stderr)
+		return 2
+
+	tests = list(find_cases(args.data, CaseIndex()))
+	if len(tests) == 0:
+		print("error: the provided path to the data directory doesn't contain any test cases", file=sys.stderr)
+		return 2
+
+	checker = find_checker(args.checker)
+
+	engine = Engine(
+		concurrency=args.jobs,
+		compile_cache=None if args.no_cache else CompileCache(),
+		result_cache=None if args.no_result_cache else ResultCache(),
+	)
+
+	compiled = await engine.compile(language, solution_path)
+	if not compiled.success:
+		print(compiled.cmd, file=sys.stderr)
+		print(compiled.output, file=sys.stderr, end="")
+		return 2
+
+	# in seconds, None if the language's startup time couldn't be measured
+	startup_time = None
+	if not args.no_calibration:
+		overhead = await Calibration().overhead(engine, language)
+		if overhead is not None:
+			startup_time = overhead.time(not args.wall)
+
+	limits = Limits(
+		args.tl,
+		cpu_time=not args.wall,
+		memory_limit=megabytes(args.ml),
+		stack_limit=megabytes(args.stack),
+		output_limit=megabytes(args.ol),
+		startup_time=startup_time if startup_time is not None and args.exclude_startup else 0,
+	)
+
+	failed = 0
+	headroom = Headroom(limits)
+
+	def report(test_index, result, benchmark):
+		test = tests[test_index]
+		time_taken = int(result.time_taken * 1000)
+		adjusted_time = None
+		if startup_time is not None:
+			adjusted_time = int(max(result.time_taken - startup_time, 0) * 1000)
+		if args.json:
+			report = {
+				"test": test_index,
+				"input": str(test[0]),
+				"output": str(test[1]),
+				"verdict": verdict_names[result.verdict],
+				"time_ms": time_taken,
+				"adjusted_ms": adjusted_time,
+				"user_ms": int(result.user_time * 1000),
+				"system_ms": int(result.system_time * 1000),
+				"wall_ms": int(result.wall_time * 1000),
+				"memory_kb": result.peak_memory // 1024,
+				"memory_exact": result.peak_memory_exact,
+				"cached": result.cached,
+			}
+			if result.mismatch is not None:
+				report["mismatch"] = vars(result.mismatch)
+			if result.cold_time is not None:
+				report["cold_ms"] = int(result.cold_time * 1000)
+				report["warm_ms"] = int(result.warm_time * 1000)
+			if benchmark is not None:
+				summary = benchmark.summary
+				report["runs"] = summary.runs
+				report["min_ms"] = int(summary.min * 1000)
+				report["median_ms"] = int(summary.median * 1000)
+				report["p95_ms"] = int(summary.p95 * 1000)
+				report["stdev_ms"] = round(summary.stdev * 1000, 1)
+				report["borderline"] = benchmark.borderline
+			print(json.dumps(report), flush=True)
+		else:
+			line = str(test_index) + "    " + verdict_names[result.verdict] + "    " + str(time_taken) + "ms    "
+			if adjusted_time is not None:
+				line += "(" + str(adjusted_time) + "ms without startup)    "
+			if result.cold_time is not None:
+				line += "(JIT cold " + str(int(result.cold_time * 1000)) + "ms, warm " + str(int(result.warm_time * 1000)) + "ms)    "
+			if benchmark is not None:
+				summary = benchmark.summary
+				line += "(min " + str(int(summary.min * 1000)) + "ms, median " + str(int(summary.median * 1000)) + "ms, p95 " + str(int(summary.p95 * 1000)) + "ms, stdev " + str(round(summary.stdev * 1000, 1)) + "ms"
+				line += " over " + str(summary.runs) + (" run" if summary.runs == 1 else " runs") + ")    "
+				if benchmark.borderline:
+					line += "BORDERLINE    "
+			if result.cached:
+				line += "(cached)    "
+			print(line + str(test[0]), flush=True)
+			if result.mismatch is not None:
+				print("    first difference at " + result.mismatch.describe(), flush=True)
+
+	# tests that failed last time go first, and are reported in the order
+	# they run
+	history = History()
+	order = history.order(solution_path, tests)
+	tasks = [asyncio.create_task(run_test(engine, language, compiled.output, tests[test_index], limits, checker, args)) for test_index in order]
+	skipped = 0
+	# the tests after those running are read ahead while they run
+	prefetcher = Prefetcher()
+	for position, test_index in enumerate(order):
+		upcoming = order[position + args.jobs:position + args.jobs + PREFETCH_DEPTH]
+		prefetcher.prefetch([tests[i] for i in upcoming])
+		result, benchmark = await tasks[position]
+		history.record(solution_path, tests[test_index], result.verdict)
+		if result.verdict != Verdict.ACCEPTED:
+			failed += 1
+		if result.verdict in (Verdict.ACCEPTED, Verdict.TIME_LIMIT):
+			headroom.add(test_index, benchmark.summary.median if benchmark is not None else result.time_taken, result.verdict == Verdict.TIME_LIMIT)
+		report(test_index, result, benchmark)
+
+		if args.fail_fast and result.verdict != Verdict.ACCEPTED:
+			skipped = len(order) - position - 1
+			for task in tasks[position + 1:]:
+				task.cancel()
+			await asyncio.gather(*tasks[position + 1:], return_exceptions=True)
+			break
+	history.flush()
+
+	if not args.json:
+		slowest = [str(test_index) + " (" + (str(round(ratio * 100)) + "% of TL" if ratio != math.inf else "TLE") + ")" for test_index, ratio in headroom.slowest(5)]
+		if len(slowest) > 0:
+			print("slowest tests: " + ", ".join(slowest))
+		print(str(len(tests) - skipped - failed) + "/" + str(len(tests)) + " tests passed")
+		if skipped > 0:
+			print(str(skipped) + " tests skipped after a failure")
+
+	return 0 if failed == 0 else 1
+
+def main(argv):
+	parser = argparse.ArgumentParser(prog="veryfire", description="Runs test cases on programs without starting the GUI.")
+	subparsers = parser.add_subparsers(dest="command", required=True)
+
+	judge_parser = subparsers.add_parser("judge", help="judge a solution against a data folder")
+	judge_parser.add_argument("solution", help="path to the solution file")
+	judge_parser.add_argument("data", help="path to the data folder")
+	judge_parser.add_argument("--language", choices=[language.key for language in languages], help="defaults to the one matching the file extension")
+	judge_parser.add_argument("--tl", type=float, default=1, help="time limit in seconds (default: 1)")
+	judge_parser.add_argument("--wall", action="store_true", help="apply the time limit to wall time instead of CPU time")
+	judge_parser.add_argument("--ml", type=int, default=256, help="memory limit in MB, 0 for none (default: 256)")
+	judge_parser.add_argument("--stack", type=int, default=0, help="stack limit in MB, 0 to keep the system's (default: 0)")
+	judge_parser.add_argument("--ol", type=int, default=64, help="output limit in MB, 0 for none (default: 64)")
+	judge_parser.add_argument("--checker", choices=[checker.key for checker in checkers], default=checkers[0].key)
+	judge_parser.add_argument("--jobs", "-j", type=positive_int, default=os.cpu_count() or 1, help="number of tests to run in parallel (default: core count)")
+	judge_parser.add_argument("--spool", action="store_true", help="write each test's output to disk instead of keeping it in memory")
+	judge_parser.add_argument("--jit-probe", action="store_true", help="for languages with a JIT (PyPy), also time each test run twice in one process")
+	judge_parser.add_argument("--runs", type=int, default=1, help="run every test this many times and report the spread of its times (default: 1)")
+	judge_parser.add_argument("--warmup", type=int, default=0, help="with --runs, runs to do and ignore before the measured ones (default: 0)")
+	judge_parser.add_argument("--exclude-startup", action="store_true", help="apply the time limit to the time taken minus the language's startup time")
+	judge_parser.add_argument("--no-calibration", action="store_true", help="don't measure the language's startup time, nor report times without it")
+	judge_parser.add_argument("--fail-fast", action="store_true", help="stop at the first test that doesn't pass")
+	judge_parser.add_argument("--no-cache", action="store_true", help="always compile the solution, even if an identical one was compiled before")
+	judge_parser.add_argument("--no-result-cache", action="store_true", help="run every test, even if the same program was run on it before")
+	judge_parser.add_argument("--json", action="store_true", help="print one JSON object per test")
+
+	args = parser.parse_args(argv)
+
+	if args.command == "judge":
+		try:
+			return asyncio.run(judge(args))
+		except KeyboardInterrupt:
+			return 130
+		finally:
+			tmp.cleanup()
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,453 @@
+from judge import Verdict, CHUNK_SIZE
+from forkserver import ForkServerPool, Spawner
+from cache import staging_name
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import asyncio
+import signal
+import errno
+import shlex
+import math
+import time
+import tmp
+import sys
+import os
+import io
+
+verbose = False
+
+class CompileResult:
+
+	def __init__(self, success, output, cmd):
+		self.success = success
+		# the compiled file on success, the compiler's error output otherwise
+		self.output = output
+		self.cmd = cmd
+
+class Limits:
+
+	def __init__(self, time_limit, cpu_time=True, memory_limit=None, stack_limit=None, output_limit=None, startup_time=0):
+		# in seconds
+		self.time_limit = time_limit
+		# in seconds, the language's startup cost (see calibration.py), which
+		# doesn't count towards the time limit
+		self.startup_time = startup_time
+		# whether the time limit applies to CPU time (user + system) rather
+		# than wall time
+		self.cpu_time = cpu_time
+		# in bytes, None for no limit
+		self.memory_limit = memory_limit
+		self.stack_limit = stack_limit
+		# in bytes, standard output and standard error combined
+		self.output_limit = output_limit
+
+	def wall_limit(self):
+		# with a CPU time limit, the wall clock is only a backstop against
+		# programs that sleep or block, so it gets some slack
+		if self.cpu_time:
+			return (self.time_limit + self.startup_time) * 2 + 1
+		return self.time_limit + self.startup_time
+
+	def cpu_limit(self):
+		# in whole seconds, for RLIMIT_CPU
+		return math.ceil(self.time_limit + self.startup_time)
+
+	def data_limit(self):
+		# in bytes, for RLIMIT_DATA. Threads' stacks are private mappings that
+		# count towards it, and glibc sizes them after RLIMIT_STACK, so the
+		# stack allowance comes on top of the memory limit; otherwise the first
+		# thread a program started would take up all of it.
+		if self.memory_limit is None:
+			return None
+		return self.memory_limit + (self.stack_limit or 0)
+
+	def exceeded(self, time_taken):
+		return time_taken - self.startup_time > self.time_limit
+
+class RunResult:
+
+	def __init__(self, verdict, output, time_taken, output_file=None, wall_time=0, user_time=0, system_time=0, peak_memory=0, peak_memory_exact=True, cold_time=None, warm_time=None):
+		self.verdict = verdict
+		# standard output when the program exits normally or gives a wrong
+		# answer or prints too much (possibly cut short), standard error when it
+		# crashes, and None when it ran out of time or memory
+		self.output = output
+		# in seconds; the CPU or wall time, whichever the time limit applies to
+		self.time_taken = time_taken
+		# when standard output was spooled to disk, the file holding it, and
+		# output is None
+		self.output_file = output_file
+		# in seconds; CPU times are measured by the kernel
+		self.wall_time = wall_time
+		self.user_time = user_time
+		self.system_time = system_time
+		# peak resident set size in bytes; when not exact, only an upper bound
+		self.peak_memory = peak_memory
+		self.peak_memory_exact = peak_memory_exact
+		# in seconds; with a JIT probe, the CPU time of running the test in a
+		# fresh process and again in the same one, None without
+		self.cold_time = cold_time
+		self.warm_time = warm_time
+		# whether this is the result of an earlier run (see resultcache.py)
+		self.cached = False
+		# with a wrong answer, where the output first differs from the expected
+		# output if the checker could tell (see judge.py)
+		self.mismatch = None
+
+class Engine:
+
+	# One coroutine per process, so that any number of compiles and runs can be
+	# in flight on a single event loop. At most `concurrency` runs execute at
+	# the same time; None means no limit. With a compile cache (see cache.py),
+	# unchanged solutions are only compiled once, and with a result cache (see
+	# resultcache.py), tests that can't have changed are only run once.
+	def __init__(self, concurrency=None, compile_cache=None, result_cache=None):
+		self.semaphore = asyncio.Semaphore(concurrency) if concurrency is not None else None
+		self.compile_cache = compile_cache
+		self.result_cache = result_cache
+		self.cache_executor = ThreadPoolExecutor(max_workers=1)
+		# pools of long-lived processes that tests can run on, by the name
+		# languages refer to them with
+		self.servers = {"fork": ForkServerPool()}
+		self.spawner = Spawner()
+
+	async def compile(self, language, filename):
+		if language.compiler is None:
+			return CompileResult(True, filename, "none")
+
+		if self.compile_cache is not None:
+			key = await self.compile_cache.key(language, filename)
+			cached_file = self.compile_cache.lookup(key)
+			if cached_file is not None:
+				if verbose:
+					print("cached: " + cached_file)
+				return CompileResult(True, cached_file, "cached")
+			output_file = self.compile_cache.staging_file(key)
+		else:
+			output_file = tmp.mktmp("solution")
+
+		header_dir = None
+		if self.compile_cache is not None and language.precompiled_header is not None:
+			header_dir = await self.compile_cache.precompiled_header(language, filename)
+
+		command = language.compile_command(filename, output_file, header_dir)
+		cmd = shlex.join(command)
+		if verbose:
+			print(cmd)
+
+		try:
+			process = await asyncio.create_subprocess_exec(
+				*command,
+				stdin=asyncio.subprocess.DEVNULL,
+				stdout=asyncio.subprocess.DEVNULL,
+				stderr=asyncio.subprocess.PIPE,
+			)
+		except OSError as e:
+			return CompileResult(False, str(e), cmd)
+
+		try:
+			_, stderr = await process.communicate()
+		except asyncio.CancelledError:
+			await kill(process)
+			discard(output_file)
+			raise
+
+		if process.returncode != 0:
+			discard(output_file)
+			return CompileResult(False, stderr.decode(errors="replace"), cmd)
+
+		if self.compile_cache is not None:
+			output_file = self.compile_cache.store(key, output_file)
+		await self.archive(language, output_file)
+		return CompileResult(True, output_file, cmd)
+
+	async def archive(self, language, compiled_file):
+		# Languages with class data sharing get a training run on empty input,
+		# which records what the program loads at startup so that later runs
+		# can skip it. Nothing depends on this succeeding.
+		# named like the compile cache's staging files, which its eviction
+		# leaves alone
+		staging_file = staging_name(language.archive_file(compiled_file))
+		command = language.archive_command(compiled_file, staging_file)
+		if command is None:
+			return
+
+		if verbose:
+			print(shlex.join(command))
+
+		try:
+			process = await asyncio.create_subprocess_exec(
+				*command,
+				stdin=asyncio.subprocess.DEVNULL,
+				stdout=asyncio.subprocess.DEVNULL,
+				stderr=asyncio.subprocess.DEVNULL,
+			)
+		except OSError:
+			return
+
+		try:
+			await asyncio.wait_for(process.wait(), ARCHIVE_TIMEOUT)
+		except asyncio.TimeoutError:
+			# it may have been killed halfway through writing the archive
+			await kill(process)
+			discard(staging_file)
+			return
+		except asyncio.CancelledError:
+			await kill(process)
+			discard(staging_file)
+			raise
+
+		if os.path.exists(staging_file):
+			os.replace(staging_file, language.archive_file(compiled_file))
+
+	# `start_check` makes a checker stream (see judge.py) once the run gets its
+	# turn, so that waiting runs hold no files open; it is fed the output as it
+	# arrives, and the program is killed as soon as it reports a mismatch or
+	# exceeds the output limit. With jit_probe, languages with a JIT compiler
+	# are also timed running the test a second time in the same process.
+	async def run(self, language, compiled_file, input_path, limits, start_check=None, spool=False, jit_probe=False):
+		result = await self.execute(language, compiled_file, input_path, limits, start_check, spool)
+		if jit_probe and language.jit:
+			times = await self.probe(language, compiled_file, input_path, limits)
+			if times is not None:
+				result.cold_time, result.warm_time = times
+		return result
+
+	# Runs a test, given as (input path, expected output path), and checks its
+	# output with `checker`, reusing the result of an identical earlier run if
+	# there is one and `reuse` is set. Probing a JIT is measuring, so it always
+	# runs the test.
+	async def judge(self, language, compiled_file, test, limits, checker, spool=False, jit_probe=False, reuse=True):
+		key = None
+		try:
+			if self.result_cache is not None and not (jit_probe and language.jit):
+				# hashing the test's files can take a while for large ones, so
+				# it's done on a thread of its own rather than holding up the
+				# other runs
+				loop = asyncio.get_running_loop()
+				key = await loop.run_in_executor(self.cache_executor, self.result_cache.key, language, compiled_file, test, checker, limits)
+				if reuse:
+					result = await loop.run_in_executor(self.cache_executor, self.result_cache.lookup, key)
+					if result is not None:
+						return result
+		except OSError as e:
+			# the test's files may be gone since it was found, say while
+			# watching the data directory
+			return RunResult(Verdict.RUNTIME_ERROR, str(e), 0)
+
+		result = await self.run(language, compiled_file, test[0], limits, start_check=lambda: checker.start(test[1]), spool=spool, jit_probe=jit_probe)
+		if key is not None:
+			await asyncio.get_running_loop().run_in_executor(self.cache_executor, self.result_cache.store, key, result)
+		return result
+
+	# Runs a test `warmup_runs + runs` times, one run after the other, and
+	# returns the results of the last `runs`. `start_check` makes a new checker
+	# stream for every run. Stops early once a run fails with anything but
+	# running out of time, since its times mean little after that. Only the
+	# last run's output is kept.
+	async def benchmark(self, language, compiled_file, input_path, limits, runs, warmup_runs=0, start_check=None, spool=False):
+		results = []
+		for i in range(warmup_runs + runs):
+			result = await self.execute(language, compiled_file, input_path, limits, start_check, spool)
+			if len(results) > 0:
+				discard(results[-1].output_file)
+				results[-1].output = results[-1].output_file = None
+			if i >= warmup_runs or result.verdict not in (Verdict.ACCEPTED, Verdict.TIME_LIMIT):
+				results.append(result)
+			else:
+				discard(result.output_file)
+			if result.verdict not in (Verdict.ACCEPTED, Verdict.TIME_LIMIT):
+				break
+		return results
+
+	async def execute(self, language, compiled_file, input_path, limits, start_check, spool):
+		if language.heap and limits.memory_limit is not None:
+			command = language.run_command(compiled_file, language.heap_options(limits.memory_limit))
+		else:
+			command = language.run_command(compiled_file)
+
+		if verbose:
+			print(shlex.join(command) + " < " + shlex.quote(str(input_path)))
+
+		# when spooling, standard output goes to a file instead of being
+		# collected in memory, so huge outputs cost no RAM
+		output_file = tmp.mktmp("user.out") if spool else None
+
+		async with self.semaphore or contextlib.nullcontext():
+			try:
+				check = start_check() if start_check is not None else None
+			except OSError as e:
+				# the expected output may be gone since the test was found, as
+				# in judge()
+				discard(output_file)
+				return RunResult(Verdict.RUNTIME_ERROR, str(e), 0)
+
+			with open(output_file, "wb") if spool else io.BytesIO() as output:
+				start = time.monotonic()
+				try:
+					if language.server is not None:
+						process = await self.servers[language.server].start(language, compiled_file, input_path, limits)
+					else:
+						process = await self.spawner.start(command, input_path, limits)
+				except OSError as e:
+					discard(output_file)
+					# the kernel refuses to load programs whose static data
+					# alone doesn't fit in the memory limit
+					if e.errno == errno.ENOMEM and limits.memory_limit is not None:
+						return RunResult(Verdict.MEMORY_LIMIT, None, 0)
+					return RunResult(Verdict.RUNTIME_ERROR, str(e), 0)
+
+				timed_out = False
+				try:
+					stopped, stderr = await asyncio.wait_for(communicate(process, output, check, limits.output_limit), limits.wall_limit())
+				except asyncio.TimeoutError:
+					timed_out = True
+					await kill(process)
+				except asyncio.CancelledError:
+					await kill(process)
+					discard(output_file)
+					raise
+
+				wall_time = time.monotonic() - start
+				user_time = process.rusage.ru_utime
+				system_time = process.rusage.ru_stime
+				time_taken = user_time + system_time if limits.cpu_time else wall_time
+				peak_memory = process.rusage.ru_maxrss * MAXRSS_UNIT
+				peak_memory_exact = peak_memory > process.memory_floor + MEMORY_FLOOR_MARGIN
+
+				def result(verdict, output):
+					return RunResult(
+						verdict,
+						output,
+						time_taken,
+						wall_time=wall_time,
+						user_time=user_time,
+						system_time=system_time,
+						peak_memory=peak_memory,
+						peak_memory_exact=peak_memory_exact,
+					)
+
+				# the kernel's CPU time limit kicks in a little before the
+				# rounded CPU times reported afterwards add up to it
+				if timed_out or limits.exceeded(time_taken) or process.returncode == -signal.SIGXCPU:
+					discard(output_file)
+					return result(Verdict.TIME_LIMIT, None)
+
+				if limits.memory_limit is not None:
+					if (peak_memory_exact and peak_memory > limits.memory_limit) or (process.returncode != 0 and out_of_memory(stderr)):
+						discard(output_file)
+						return result(Verdict.MEMORY_LIMIT, None)
+
+				if stopped is None and process.returncode != 0:
+					discard(output_file)
+					return result(Verdict.RUNTIME_ERROR, stderr.decode(errors="replace"))
+
+				if stopped is None and check is not None and not check.finish():
+					stopped = Verdict.WRONG_ANSWER
+
+				verdict = stopped or Verdict.ACCEPTED
+				if spool:
+					run_result = result(verdict, None)
+					run_result.output_file = output_file
+				else:
+					run_result = result(verdict, output.getvalue().decode(errors="replace"))
+				if verdict == Verdict.WRONG_ANSWER:
+					run_result.mismatch = check.mismatch
+				return run_result
+
+	async def probe(self, language, compiled_file, input_path, limits):
+		# Returns the CPU time of the cold and the warm run, or None if the
+		# probe didn't finish. Its output is thrown away.
+		report_file = tmp.mktmp("jit.txt")
+		command = language.probe_command(compiled_file, report_file)
+		if verbose:
+			print(shlex.join(command) + " < " + shlex.quote(str(input_path)))
+
+		# room for both runs
+		probe_limits = Limits(limits.time_limit * 2, limits.cpu_time, limits.memory_limit, limits.stack_limit)
+
+		async with self.semaphore or contextlib.nullcontext():
+			try:
+				process = await self.spawner.start(command, input_path, probe_limits)
+			except OSError:
+				return None
+
+			try:
+				with open(os.devnull, "wb") as output:
+					await asyncio.wait_for(communicate(process, output, None, None), probe_limits.wall_limit())
+			except asyncio.TimeoutError:
+				await kill(process)
+			except asyncio.CancelledError:
+				await kill(process)
+				discard(report_file)
+				raise
+
+		try:
+			with open(report_file, "r") as file:
+				cold_time, warm_time = map(float, file.read().split())
+		except (OSError, ValueError):
+			return None
+		finally:
+			discard(report_file)
+		return cold_time, warm_time
+
+# in seconds; training runs that take longer are given up on
+ARCHIVE_TIMEOUT = 10
+
+# ru_maxrss is in kilobytes everywhere but on macOS
+MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+# slack for the pages a child touches between fork and exec
+MEMORY_FLOOR_MARGIN = 1024 * 1024
+
+# what the usual runtimes print when an allocation fails
+out_of_memory_messages = [b"std::bad_alloc", b"MemoryError", b"OutOfMemoryError", b"os::commit_memory"]
+
+def out_of_memory(stderr):
+	return any(message in stderr for message in out_of_memory_messages)
+
+async def communicate(process, output, check, output_limit):
+	# Returns why the program was stopped early, if it was: WRONG_ANSWER when
+	# the checker found a mismatch, OUTPUT_LIMIT when it printed too much.
+	# Both streams count towards the output limit.
+	stopped = None
+	total_size = 0
+	stderr = io.BytesIO()
+
+	async def pump(stream, sink, check):
+		nonlocal stopped, total_size
+
+		while stopped is None:
+			chunk = await stream.read(CHUNK_SIZE)
+			if not chunk:
+				return
+
+			total_size += len(chunk)
+			if output_limit is not None and total_size > output_limit:
+				stopped = Verdict.OUTPUT_LIMIT
+			else:
+				sink.write(chunk)
+				if check is not None and not check.feed(chunk):
+					stopped = Verdict.WRONG_ANSWER
+
+			if stopped is not None:
+				process.kill()
+
+	await asyncio.gather(pump(process.stdout, output, check), pump(process.stderr, stderr, None))
+	await process.wait()
+	return stopped, stderr.getvalue()
+
+async def kill(process):
+	if process.returncode is None:
+		try:
+			process.kill()
+		except ProcessLookupError:
+			pass
+	await process.wait()
+
+def discard(output_file):
+	if output_file is not None:
+		try:
+			os.remove(output_file)
+		except FileNotFoundError:
+			pass
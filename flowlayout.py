@@ -112,10 +112,14 @@ class FlowLayout(QLayout):
 		y = rect.y()
 		lineHeight = 0
 
+		# every item is a push button with the same style, so the spacing is
+		# looked up once rather than for each of (possibly thousands of) items
+		if len(self.itemList) > 0:
+			style = self.itemList[0].widget().style()
+			spaceX = self.spacing() + style.layoutSpacing(QSizePolicy.PushButton, QSizePolicy.PushButton, Qt.Horizontal)
+			spaceY = self.spacing() + style.layoutSpacing(QSizePolicy.PushButton, QSizePolicy.PushButton, Qt.Vertical)
+
 		for item in self.itemList:
-			wid = item.widget()
-			spaceX = self.spacing() + wid.style().layoutSpacing(QSizePolicy.PushButton, QSizePolicy.PushButton, Qt.Horizontal)
-			spaceY = self.spacing() + wid.style().layoutSpacing(QSizePolicy.PushButton, QSizePolicy.PushButton, Qt.Vertical)
 			nextX = x + item.sizeHint().width() + spaceX
 			if nextX - spaceX > rect.right() and lineHeight > 0:
 				x = rect.x()
@@ -0,0 +1,170 @@
+import resource
+import asyncio
+import socket
+import signal
+import json
+import sys
+import os
+import tmp
+
+# Fork servers for judging Python without starting an interpreter for every
+# test. A server (forkserver_main.py) is started per solution; it imports the
+# usual modules and compiles the solution once, then forks a child per test.
+# The server reaps its children and reports their exit status and resource
+# usage, so runs are judged exactly like those of a fresh interpreter.
+#
+# The same server started without a solution is veryfire's spawner: every
+# other program runs as one of its children, so none is forked from veryfire
+# itself, which has threads running and would count towards its peak memory.
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "forkserver_main.py")
+
+class ForkServerPool:
+
+	def __init__(self):
+		# solution -> (its modification time, future of its server)
+		self.servers = {}
+
+	async def start(self, language, compiled_file, input_path, limits):
+		server = await self.server(language, compiled_file)
+		return await server.start(input_path, limits)
+
+	async def server(self, language, compiled_file):
+		# servers compile the solution up front, so editing it means starting
+		# a new one
+		version = os.stat(compiled_file).st_mtime_ns
+		entry = self.servers.get(compiled_file)
+		if entry is None or entry[0] != version or not usable(entry[1]):
+			if entry is not None and entry[1].done() and entry[1].exception() is None:
+				entry[1].result().stop()
+			entry = (version, asyncio.ensure_future(ForkServer.launch(language.run_command(SERVER_SCRIPT), compiled_file)))
+			self.servers[compiled_file] = entry
+		return await asyncio.shield(entry[1])
+
+class Spawner:
+
+	def __init__(self):
+		self.server = None
+
+	async def start(self, command, input_path, limits):
+		if self.server is None or not usable(self.server):
+			# interpreter flags keep the spawner (and so every child's memory
+			# floor) as small as it gets
+			self.server = asyncio.ensure_future(ForkServer.launch([sys.executable, "-I", "-S", SERVER_SCRIPT]))
+		server = await asyncio.shield(self.server)
+		return await server.start(input_path, limits, command)
+
+def usable(server):
+	if not server.done():
+		return True
+	return server.exception() is None and server.result().process.returncode is None
+
+class ForkServer:
+
+	def __init__(self, process, socket_path):
+		self.process = process
+		self.socket_path = socket_path
+
+	@staticmethod
+	async def launch(command, *arguments):
+		socket_path = tmp.mktmp("fork.sock")
+		process = await asyncio.create_subprocess_exec(
+			*command, socket_path, *arguments,
+			stdin=asyncio.subprocess.PIPE,
+			stdout=asyncio.subprocess.PIPE,
+			stderr=asyncio.subprocess.DEVNULL,
+		)
+		if await process.stdout.readline() != b"ready\n":
+			await process.wait()
+			raise OSError("the fork server failed to start")
+		return ForkServer(process, socket_path)
+
+	def stop(self):
+		# the server exits once its stdin is closed
+		self.process.stdin.close()
+
+	async def start(self, input_path, limits, command=None):
+		loop = asyncio.get_running_loop()
+		connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		connection.setblocking(False)
+		stdout_read, stdout_write = os.pipe()
+		stderr_read, stderr_write = os.pipe()
+		try:
+			await loop.sock_connect(connection, self.socket_path)
+
+			request = {
+				"cpu_time": limits.cpu_limit() if limits.cpu_time else None,
+				"data_limit": limits.data_limit(),
+				"stack_limit": limits.stack_limit,
+			}
+			if command is not None:
+				request["command"] = command
+			with open(input_path, "rb") as stdin:
+				socket.send_fds(connection, [json.dumps(request).encode()], [stdin.fileno(), stdout_write, stderr_write])
+		except OSError:
+			connection.close()
+			os.close(stdout_read)
+			os.close(stderr_read)
+			raise
+		finally:
+			os.close(stdout_write)
+			os.close(stderr_write)
+
+		reader, writer = await asyncio.open_unix_connection(sock=connection)
+		fields = (await reader.readline()).split()
+		if fields[:1] != [b"started"]:
+			writer.close()
+			os.close(stdout_read)
+			os.close(stderr_read)
+			if fields[:1] == [b"failed"]:
+				# as Popen would have raised it
+				error = int(fields[1])
+				raise OSError(error, os.strerror(error), command[0])
+			raise OSError("the fork server didn't start the program")
+
+		stdout = await open_reader(stdout_read)
+		stderr = await open_reader(stderr_read)
+		return ForkRun(int(fields[1]), int(fields[2]), reader, writer, stdout, stderr)
+
+async def open_reader(fd):
+	loop = asyncio.get_running_loop()
+	reader = asyncio.StreamReader()
+	await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(fd, "rb"))
+	return reader
+
+class ForkRun:
+
+	# A child of a fork server, with the parts of asyncio's Process that
+	# engine.communicate() uses.
+
+	def __init__(self, pid, memory_floor, reader, writer, stdout, stderr):
+		self.pid = pid
+		self.stdout = stdout
+		self.stderr = stderr
+		self.returncode = None
+		self.rusage = None
+		# the child starts out sharing the server's memory
+		self.memory_floor = memory_floor
+		self.exited = asyncio.ensure_future(read_exit(reader, writer))
+
+	def kill(self):
+		if not self.exited.done():
+			try:
+				os.kill(self.pid, signal.SIGKILL)
+			except ProcessLookupError:
+				pass
+
+	async def wait(self):
+		if self.returncode is None:
+			status, rusage = await asyncio.shield(self.exited)
+			self.returncode = os.waitstatus_to_exitcode(status)
+			self.rusage = rusage
+		return self.returncode
+
+async def read_exit(reader, writer):
+	fields = (await reader.readline()).split()
+	writer.close()
+	if fields[:1] != [b"exited"]:
+		# the server itself died, taking the report with it
+		return signal.SIGKILL, resource.struct_rusage([0] * 16)
+	return int(fields[1]), resource.struct_rusage([float(field) for field in fields[2:4]] + [int(field) for field in fields[4:]])
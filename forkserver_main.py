@@ -0,0 +1,242 @@
+# Runs Python solutions for veryfire (see forkserver.py) without starting a
+# new interpreter for every test. This process imports the modules solutions
+# commonly use and compiles the solution once, then forks a child per test,
+# which starts out with all of that already done.
+#
+# Usage: python3 forkserver_main.py <socket path> [<solution>]
+#
+# Without a solution, it's a spawner instead: each child runs the command in
+# its request, with the limits applied. veryfire starts programs this way
+# rather than forking itself, since a child counts the memory of whatever
+# forked it towards its peak RSS, even across exec, and this process is
+# small and has no other threads.
+#
+# Each connection to the socket is one test. The request is a JSON object
+# with the limits to apply (and the command, for a spawner), sent along with
+# three file descriptors: the child's stdin, stdout and stderr. The reply is
+# two lines: "started <pid> <memory floor>" once the child is forked, then
+# "exited <wait status> <rusage fields>" once it's gone, or else "failed
+# <errno>" if the command couldn't be run. The server exits when its stdin
+# closes.
+
+import sys
+import os
+
+socket_path = sys.argv[1]
+solution = os.path.abspath(sys.argv[2]) if len(sys.argv) > 2 else None
+
+if solution is not None:
+	sys.argv = [solution]
+	sys.path[0] = os.path.dirname(solution)
+
+	# imported before forking, so children get them for free
+	import collections
+	import functools
+	import itertools
+	import bisect
+	import heapq
+	import math
+	import string
+	import re
+	import io
+
+import selectors
+import resource
+import signal
+import socket
+import json
+
+if solution is not None:
+	try:
+		with open(solution, "rb") as file:
+			code = compile(file.read(), solution, "exec")
+		compile_error = None
+	except SyntaxError as e:
+		code = None
+		compile_error = e
+
+def set_limit(kind, value):
+	_, hard = resource.getrlimit(kind)
+	if hard != resource.RLIM_INFINITY:
+		value = min(value, hard)
+	resource.setrlimit(kind, (value, value))
+
+def resident_memory():
+	try:
+		with open("/proc/self/statm", "r") as file:
+			return int(file.read().split()[1]) * resource.getpagesize()
+	except OSError:
+		return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def run_child(request, fds, server_fds, error_write):
+	signal.set_wakeup_fd(-1)
+	signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+	for fd in server_fds:
+		os.close(fd)
+	for target, fd in enumerate(fds):
+		os.dup2(fd, target)
+		os.close(fd)
+
+	# the kernel stops the program shortly after its CPU time runs out
+	if request["cpu_time"] is not None:
+		resource.setrlimit(resource.RLIMIT_CPU, (request["cpu_time"], request["cpu_time"] + 1))
+	# RLIMIT_DATA rather than RLIMIT_AS, so that the stack is limited on its
+	# own and runtimes that reserve (but don't use) lots of address space
+	# still start
+	if request["data_limit"] is not None:
+		set_limit(resource.RLIMIT_DATA, request["data_limit"])
+	if request["stack_limit"] is not None:
+		set_limit(resource.RLIMIT_STACK, request["stack_limit"])
+
+	if "command" in request:
+		try:
+			os.execvp(request["command"][0], request["command"])
+		except OSError as e:
+			os.write(error_write, str(e.errno).encode())
+		os._exit(127)
+
+	if request["stack_limit"] is not None:
+		# a fresh interpreter would size its threads' stacks after the limit
+		import threading
+		threading.stack_size(request["stack_limit"])
+
+	# the random module would otherwise hand every child the same numbers
+	if "random" in sys.modules:
+		sys.modules["random"].seed()
+
+	# what follows mimics running the solution with `python3 <solution>`:
+	# a fresh __main__, tracebacks without this file's frames, and exit codes
+	# taken from SystemExit
+	main = type(sys)("__main__")
+	main.__file__ = solution
+	main.__builtins__ = __builtins__
+	sys.modules["__main__"] = main
+
+	status = 0
+	if compile_error is not None:
+		sys.excepthook(type(compile_error), compile_error.with_traceback(None), None)
+		status = 1
+	else:
+		try:
+			exec(code, main.__dict__)
+			wait_for_threads()
+		except SystemExit as e:
+			status = exit_status(e.code)
+		except BaseException as e:
+			e = e.with_traceback(e.__traceback__.tb_next)
+			sys.excepthook(type(e), e, e.__traceback__)
+			status = 1
+
+	try:
+		import atexit
+		atexit._run_exitfuncs()
+		sys.stdout.flush()
+		sys.stderr.flush()
+	except BaseException:
+		pass
+	os._exit(status)
+
+def wait_for_threads():
+	import threading
+	for thread in threading.enumerate():
+		if thread is not threading.main_thread() and not thread.daemon:
+			thread.join()
+
+def exit_status(code):
+	if code is None:
+		return 0
+	if isinstance(code, int):
+		return code & 0xff
+	print(code, file=sys.stderr)
+	return 1
+
+def main():
+	listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	listener.bind(socket_path)
+	listener.listen(64)
+
+	wakeup_read, wakeup_write = os.pipe()
+	os.set_blocking(wakeup_write, False)
+	signal.set_wakeup_fd(wakeup_write)
+	signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+	selector = selectors.DefaultSelector()
+	selector.register(listener, selectors.EVENT_READ, "accept")
+	selector.register(wakeup_read, selectors.EVENT_READ, "reap")
+	selector.register(sys.stdin, selectors.EVENT_READ, "quit")
+
+	# child pid -> connection to report its exit on
+	children = {}
+
+	print("ready", flush=True)
+
+	while True:
+		for key, _ in selector.select():
+			if key.data == "accept":
+				connection, _ = listener.accept()
+				try:
+					message, fds, _, _ = socket.recv_fds(connection, 65536, 3)
+					request = json.loads(message)
+				except (OSError, ValueError):
+					connection.close()
+					continue
+
+				# closed on exec, so the child only writes to it when exec fails
+				error_read, error_write = os.pipe() if "command" in request else (None, None)
+				memory_floor = resident_memory()
+				pid = os.fork()
+				if pid == 0:
+					server_fds = [listener.fileno(), connection.fileno(), wakeup_read, wakeup_write]
+					server_fds += [other.fileno() for other in children.values()]
+					if error_read is not None:
+						server_fds.append(error_read)
+					try:
+						run_child(request, fds, server_fds, error_write)
+					finally:
+						os._exit(1)
+
+				for fd in fds:
+					os.close(fd)
+				if error_read is not None:
+					os.close(error_write)
+					error = read_all(error_read)
+					os.close(error_read)
+					if error:
+						# reaped here, before the SIGCHLD handler gets to it
+						os.waitpid(pid, 0)
+						send(connection, "failed " + error.decode())
+						connection.close()
+						continue
+				children[pid] = connection
+				send(connection, "started " + str(pid) + " " + str(memory_floor))
+
+			elif key.data == "reap":
+				os.read(wakeup_read, 4096)
+				while len(children) > 0:
+					pid, status, rusage = os.wait4(-1, os.WNOHANG)
+					if pid == 0:
+						break
+					connection = children.pop(pid)
+					send(connection, "exited " + str(status) + " " + " ".join(map(str, rusage)))
+					connection.close()
+
+			elif key.data == "quit":
+				if not os.read(sys.stdin.fileno(), 4096):
+					return
+
+def read_all(fd):
+	data = b""
+	while True:
+		chunk = os.read(fd, 4096)
+		if not chunk:
+			return data
+		data += chunk
+
+def send(connection, line):
+	# veryfire may have given up on the test already
+	try:
+		connection.sendall((line + "\n").encode())
+	except OSError:
+		pass
+
+main()
@@ -0,0 +1,70 @@
+from judge import Verdict
+from cache import cache_root
+import json
+import os
+
+# Remembers which tests each solution failed the last time they were run, so
+# that they can be run first the next time: after a fix, whether it worked is
+# known right away rather than after every test before them has passed again.
+# Solutions and tests are identified by their paths.
+
+class History:
+
+	def __init__(self, path=None):
+		self.path = path or os.path.join(cache_root(), "history.json")
+		# solution path -> set of the input paths of the tests it failed
+		self.failures = None
+		# whether failures has changes that aren't written out yet
+		self.dirty = False
+
+	def load(self):
+		if self.failures is None:
+			try:
+				with open(self.path, "r") as file:
+					self.failures = {solution_path: set(input_paths) for solution_path, input_paths in json.load(file).items()}
+			except (OSError, ValueError, AttributeError, TypeError):
+				self.failures = {}
+		return self.failures
+
+	def save(self):
+		os.makedirs(os.path.dirname(self.path), exist_ok=True)
+		staging_file = self.path + ".tmp" + str(os.getpid())
+		with open(staging_file, "w") as file:
+			json.dump({solution_path: sorted(input_paths) for solution_path, input_paths in self.failures.items()}, file, indent="\t")
+		os.replace(staging_file, self.path)
+
+	def flush(self):
+		# writes out what record() changed, once a run is over rather than
+		# after every test, which would take time in the number of failures
+		if self.dirty:
+			self.save()
+			self.dirty = False
+
+	def failed(self, solution_path):
+		# the input paths of the tests the solution failed last time
+		return set(self.load().get(os.path.abspath(solution_path), ()))
+
+	def order(self, solution_path, tests):
+		# the indices of the tests in the order to run them: those that failed
+		# last time first, then the rest, each in their original order
+		failed = self.failed(solution_path)
+		indices = range(len(tests))
+		return [i for i in indices if str(tests[i][0]) in failed] + [i for i in indices if str(tests[i][0]) not in failed]
+
+	def record(self, solution_path, test, verdict):
+		# kept in memory until flush()
+		failures = self.load()
+		solution_path = os.path.abspath(solution_path)
+		failed = failures.get(solution_path, set())
+		input_path = str(test[0])
+		if (verdict != Verdict.ACCEPTED) == (input_path in failed):
+			return
+
+		if verdict != Verdict.ACCEPTED:
+			failed.add(input_path)
+			failures[solution_path] = failed
+		else:
+			failed.discard(input_path)
+			if len(failed) == 0:
+				del failures[solution_path]
+		self.dirty = True
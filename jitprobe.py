@@ -0,0 +1,41 @@
+# Measures how much of a solution's running time goes to warming up a JIT
+# compiler (see PyPy3Judge in judge.py): the solution runs twice on the same
+# input in one process, so the second run starts with the code the first one
+# compiled. The CPU time of each run, in seconds, is written to the report
+# file as "<cold> <warm>". The solution's output is not judged.
+#
+# Usage: pypy3 jitprobe.py <report file> <solution>
+
+import sys
+import os
+import time
+
+report_file = sys.argv[1]
+solution = os.path.abspath(sys.argv[2])
+sys.argv = [solution]
+sys.path[0] = os.path.dirname(solution)
+
+with open(solution, "rb") as file:
+	code = compile(file.read(), solution, "exec")
+
+times = []
+for i in range(2):
+	# both runs read the whole input, which has to be a regular file
+	os.lseek(0, 0, os.SEEK_SET)
+	sys.stdin = open(0, "r", closefd=False)
+
+	main = type(sys)("__main__")
+	main.__file__ = solution
+	main.__builtins__ = __builtins__
+	sys.modules["__main__"] = main
+
+	start = time.process_time()
+	try:
+		exec(code, main.__dict__)
+	except SystemExit:
+		pass
+	sys.stdout.flush()
+	times.append(time.process_time() - start)
+
+with open(report_file, "w") as file:
+	file.write(" ".join(map(str, times)))
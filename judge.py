@@ -1,10 +1,15 @@
-from PyQt5.QtCore import QProcess, QTimer
 from pathlib import Path
 from enum import Enum
-import tempfile
-import time
+import warnings
+import shutil
+import mmap
+import os
+import io
 
-verbose = False
+# optional; with it, the epsilon checker compares whole chunks of numbers at
+# once (see EpsilonStream). It's only imported once a checker needs it (see
+# load_numpy()), since importing it takes longer than starting up without it
+numpy = None
 
 class Verdict(Enum):
 	ACCEPTED = 0
@@ -12,282 +17,907 @@ class Verdict(Enum):
 	TIME_LIMIT = 2
 	MEMORY_LIMIT = 3
 	RUNTIME_ERROR = 4
+	OUTPUT_LIMIT = 5
+
+verdict_names = {
+	Verdict.ACCEPTED: "PASS",
+	Verdict.WRONG_ANSWER: "WA",
+	Verdict.TIME_LIMIT: "TLE",
+	Verdict.MEMORY_LIMIT: "MLE",
+	Verdict.RUNTIME_ERROR: "RTE",
+	Verdict.OUTPUT_LIMIT: "OLE",
+}
+
+# Languages only describe the commands used to build and run a solution; the
+# processes themselves are started by runner.py (GUI) or cli.py (headless), so
+# that this module can be imported without Qt.
 
 class JavaJudge:
 
 	def __init__(self):
 		self.name = "Java"
-
-	def compile(self, filename, callback):
-		raise NotImplementedError("TODO: implement java")
-
-	def run(self, compiled_file, input_data, time_limit, callback):
-		process = QProcess()
-
-		cmd = "java " + compiled_file[:-6]
-		if verbose:
-			print(cmd)
-
-		start = time.time()
-		process.start("java", [compiled_file[:-6]])
-		process.write(input_data.encode("utf-8"))
-		process.closeWriteChannel()
-
-		self.kill_timer = QTimer()
-		self.kill_timer.start(int(time_limit * 1000))
-		self.kill_timer.setSingleShot(True)
-
-		callback_called = False
-
-		def on_timeout():
-			nonlocal callback_called
-
-			if not callback_called:
-				callback_called = True
-				callback(Verdict.TIME_LIMIT, None, ">" + str(int(time_limit * 1000)) + "ms")
-
-			process.kill()
-
-		self.kill_timer.timeout.connect(on_timeout)
-
-		def on_finished(exit_code, exit_status):
-			nonlocal callback_called
-
-			if not callback_called:
-				callback_called = True
-				time_taken = str(int((time.time() - start) * 1000)) + "ms"
-				if exit_code == 0 and exit_status == QProcess.NormalExit:
-					callback(Verdict.ACCEPTED, process.readAllStandardOutput().data().decode(), time_taken)
-				else:
-					callback(Verdict.RUNTIME_ERROR, process.readAllStandardError().data().decode(), time_taken)
-
-		process.finished.connect(on_finished)
+		self.key = "java"
+		self.extension = ".java"
+		self.compiler = "javac"
+		self.flags = ["-encoding", "UTF-8"]
+		self.precompiled_header = None
+		self.server = None
+		self.empty_program = "public class Main {\n\tpublic static void main(String[] args) {\n\t}\n}\n"
+		self.jit = False
+		# the JVM sizes its heap after the machine's memory rather than the
+		# memory limit unless told otherwise (see heap_options())
+		self.heap = True
+
+	def compile_command(self, filename, output_file, header_dir=None):
+		# class data sharing only works with classes loaded from jars, so the
+		# class files are packed into one, which also records the main class
+		script = 'out=$1 main=$2 src=$3; shift 3; classes=$(mktemp -d) || exit; trap \'rm -rf "$classes"\' EXIT; "$@" -d "$classes" "$src" && jar --create --file "$out" --main-class "$main" -C "$classes" .'
+		return ["sh", "-c", script, "javac", output_file, Path(filename).stem, filename, self.compiler, *self.flags]
+
+	def archive_file(self, compiled_file):
+		return compiled_file + ".jsa"
+
+	def archive_command(self, compiled_file, archive_file):
+		# the classes a run loads are dumped into an archive when it exits,
+		# which later runs map straight into memory instead of loading them
+		return ["java", "-XX:ArchiveClassesAtExit=" + archive_file, "-jar", compiled_file]
+
+	def heap_options(self, memory_limit):
+		# The initial heap defaults to 1/64 of the machine's memory, which on a
+		# large one is more than the whole memory limit, and the JVM would fail
+		# to start under RLIMIT_DATA. A quarter of the limit leaves room for
+		# what the JVM needs besides its heap.
+		return ["-Xmx" + str(memory_limit), "-Xms" + str(memory_limit // 4)]
+
+	def run_command(self, compiled_file, options=[]):
+		# logging is off so that the JVM can't print warnings to standard
+		# output, say if it ends up rejecting the archive. Nor can it print
+		# its fatal error report there (which it does when it runs out of
+		# native memory under the memory limit), or leave the report's file
+		# and a core dump behind; it just aborts
+		options = ["-Xlog:disable", "-XX:+SuppressFatalErrorMessage", "-XX:-CreateCoredumpOnCrash", *options]
+		archive_file = self.archive_file(compiled_file)
+		if os.path.exists(archive_file):
+			options.append("-XX:SharedArchiveFile=" + archive_file)
+		return ["java", *options, "-jar", compiled_file]
 
 class CppJudge:
 
 	def __init__(self):
 		self.name = "C++"
-
-	def compile(self, filename, callback):
-		process = QProcess()
-
-		output_file = tempfile.mktemp()
-
-		cmd = "g++ -O2 -o " + output_file + " \"" + filename + "\""
-		if verbose:
-			print(cmd)
-
-		process.start("g++", ["-fdiagnostics-color=always", "-O2", "-o", output_file, filename])
-
-		def on_finished(exit_code, exit_status):
-			if exit_code == 0 and exit_status == QProcess.NormalExit:
-				callback(True, output_file, cmd)
-			else:
-				err = process.readAllStandardError().data().decode()
-				callback(False, err, cmd)
-
-		process.finished.connect(on_finished)
-
-	def run(self, compiled_file, input_data, time_limit, callback):
-		process = QProcess()
-
-		cmd = compiled_file
-		if verbose:
-			print(cmd)
-
-		start = time.time()
-		process.start(compiled_file)
-		process.write(input_data.encode("utf-8"))
-		process.closeWriteChannel()
-
-		self.kill_timer = QTimer()
-		self.kill_timer.start(int(time_limit * 1000))
-		self.kill_timer.setSingleShot(True)
-
-		callback_called = False
-
-		def on_timeout():
-			nonlocal callback_called
-
-			if not callback_called:
-				callback_called = True
-				callback(Verdict.TIME_LIMIT, None, ">" + str(int(time_limit * 1000)) + "ms")
-
-			process.kill()
-
-		self.kill_timer.timeout.connect(on_timeout)
-
-		def on_finished(exit_code, exit_status):
-			nonlocal callback_called
-
-			if not callback_called:
-				callback_called = True
-				time_taken = str(int((time.time() - start) * 1000)) + "ms"
-				if exit_code == 0 and exit_status == QProcess.NormalExit:
-					callback(Verdict.ACCEPTED, process.readAllStandardOutput().data().decode(), time_taken)
-				else:
-					callback(Verdict.RUNTIME_ERROR, process.readAllStandardError().data().decode(), time_taken)
-
-		process.finished.connect(on_finished)
+		self.key = "cpp"
+		self.extension = ".cpp"
+		self.compiler = "g++"
+		self.flags = ["-fdiagnostics-color=always", "-O2"]
+		self.precompiled_header = "bits/stdc++.h"
+		self.server = None
+		self.empty_program = "int main() {\n}\n"
+		self.jit = False
+		self.heap = False
+
+	def compile_command(self, filename, output_file, header_dir=None):
+		# a precompiled header in header_dir is found before the real one
+		include = ["-I", header_dir] if header_dir is not None else []
+		return [self.compiler, *self.flags, *include, "-o", output_file, filename]
+
+	def precompile_command(self, header, output_file):
+		return [self.compiler, *self.flags, "-x", "c++-header", "-o", output_file, header]
+
+	def archive_command(self, compiled_file, archive_file):
+		return None
+
+	def run_command(self, compiled_file):
+		return [compiled_file]
 
 class Python3Judge:
 
-	def __init__(self):
-		self.name = "Python 3"
-
-	def compile(self, filename, callback):
-		callback(True, filename, "none")
-
-	def run(self, compiled_file, input_data, time_limit, callback):
-		process = QProcess()
-
-		cmd = "python3 " + compiled_file
-		if verbose:
-			print(cmd)
-
-		start = time.time()
-		process.start("python3", [compiled_file])
-		process.write(input_data.encode("utf-8"))
-		process.closeWriteChannel()
-
-		self.kill_timer = QTimer()
-		self.kill_timer.start(int(time_limit * 1000))
-		self.kill_timer.setSingleShot(True)
+	# With fork_server set, tests are forked from a warm interpreter that has
+	# already compiled the solution (see forkserver.py) instead of starting a
+	# new one each. `server` names the engine's pool of such long-lived
+	# processes a language runs on, if any.
 
-		callback_called = False
+	def __init__(self, fork_server=False):
+		self.name = "Python 3 (fork server)" if fork_server else "Python 3"
+		self.key = "python3-fork" if fork_server else "python3"
+		self.extension = ".py"
+		# the source file is run as is
+		self.compiler = None
+		self.flags = []
+		self.precompiled_header = None
+		self.server = "fork" if fork_server else None
+		self.empty_program = ""
+		self.jit = False
+		self.heap = False
 
-		def on_timeout():
-			nonlocal callback_called
+	def archive_command(self, compiled_file, archive_file):
+		return None
 
-			if not callback_called:
-				callback_called = True
-				callback(Verdict.TIME_LIMIT, None, ">" + str(int(time_limit * 1000)) + "ms")
+	def run_command(self, compiled_file):
+		return ["python3", compiled_file]
 
-			process.kill()
+class PyPy3Judge:
 
-		self.kill_timer.timeout.connect(on_timeout)
+	def __init__(self):
+		self.name = "PyPy 3"
+		self.key = "pypy3"
+		self.extension = ".py"
+		self.compiler = None
+		self.flags = []
+		self.precompiled_header = None
+		self.server = None
+		self.empty_program = ""
+		# JIT warm-up can be measured with probe_command()
+		self.jit = True
+		self.heap = False
+
+	def archive_command(self, compiled_file, archive_file):
+		return None
+
+	def run_command(self, compiled_file):
+		return ["pypy3", compiled_file]
+
+	def probe_command(self, compiled_file, report_file):
+		return ["pypy3", JIT_PROBE_SCRIPT, report_file, compiled_file]
+
+JIT_PROBE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "jitprobe.py")
+
+languages = [JavaJudge(), CppJudge(), Python3Judge(), Python3Judge(fork_server=True)]
+
+# only offered where it's installed
+if shutil.which("pypy3") is not None:
+	languages.append(PyPy3Judge())
+
+# Checkers compare a program's output to the expected output. check() works on
+# whole strings, while start() returns a stream that is fed the output chunk by
+# chunk as the program prints it; feed() returns False as soon as the output
+# can no longer be correct, so that the program can be killed early.
+
+CHUNK_SIZE = 64 * 1024
+
+# the bytes bytes.split() splits on
+WHITESPACE = b" \t\n\r\x0b\x0c"
+
+# maps whitespace to b" " and everything else to b"x", for counting tokens
+TOKEN_CLASSES = bytes(ord(" ") if c in WHITESPACE else ord("x") for c in range(256))
+
+# tokens and lines quoted in a mismatch are cut short past this many characters
+EXCERPT_LENGTH = 40
+
+class Mismatch:
+
+	# Where an output first differs from the expected output, for showing
+	# along with a wrong answer. `expected` and `provided` quote what differs
+	# (see excerpt()), None for the side that ended first. Positions count
+	# from 1, and are None where a checker doesn't know them. Checkers that
+	# compare lines also give where the differing line starts in either file,
+	# in bytes, so that it can be shown without searching for it.
+
+	def __init__(self, expected, provided, token=None, line=None, column=None, expected_offset=None, provided_offset=None):
+		self.expected = expected
+		self.provided = provided
+		self.token = token
+		self.line = line
+		self.column = column
+		self.expected_offset = expected_offset
+		self.provided_offset = provided_offset
+
+	def describe(self):
+		location = []
+		if self.token is not None:
+			location.append("token " + str(self.token))
+		if self.line is not None:
+			location.append("line " + str(self.line))
+		if self.column is not None:
+			location.append("column " + str(self.column))
+
+		if self.expected is None:
+			difference = "expected the output to end, got " + self.provided
+		elif self.provided is None:
+			difference = "expected " + self.expected + ", but the output ended"
+		else:
+			difference = "expected " + self.expected + ", got " + self.provided
+		return ", ".join(location) + ": " + difference
+
+def excerpt(data, start=0):
+	# data quoted for a mismatch, from the byte at `start` on
+	if data is None:
+		return None
+	text = data[start:].decode(errors="replace")
+	if len(text) > EXCERPT_LENGTH:
+		text = text[:EXCERPT_LENGTH] + "..."
+	if start > 0:
+		text = "..." + text
+	return '"' + text + '"'
+
+def map_file(path):
+	# The file's contents as a buffer that's only read in as it's used, and
+	# from the page cache rather than into veryfire's memory.
+	with io.open(path, "rb") as file:
+		try:
+			return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+		except ValueError:
+			# empty files can't be mapped
+			return b""
+
+def last_whitespace(data):
+	return max(data.rfind(c) for c in WHITESPACE)
+
+def next_piece(buffer, position, separator=None):
+	# About a chunk of buffer from position on, up to its last whitespace (or
+	# separator) so that no token (or line) is cut in half, or up to the end.
+	size = CHUNK_SIZE
+	while True:
+		end = position + size
+		piece = buffer[position:end]
+		if end >= len(buffer):
+			return piece
+		cut = (last_whitespace(piece) if separator is None else piece.rfind(separator)) + 1
+		if cut > 0:
+			return piece[:cut]
+		size *= 2
+
+def find_token(buffer, number):
+	# the token with the given number (from 1) in buffer, or None if there
+	# are fewer
+	position = 0
+	while position < len(buffer):
+		piece = next_piece(buffer, position)
+		count = (b" " + piece.translate(TOKEN_CLASSES)).count(b" x")
+		if number <= count:
+			return piece.split()[number - 1]
+		number -= count
+		position += len(piece)
+	return None
+
+def count_tokens(buffer, end):
+	# the number of tokens in buffer[:end], a block at a time so that it takes
+	# no memory to speak of even for a mapped file
+	count = 0
+	previous = b" "
+	for start in range(0, end, CHUNK_SIZE * 16):
+		classes = previous + buffer[start:min(start + CHUNK_SIZE * 16, end)].translate(TOKEN_CLASSES)
+		count += classes.count(b" x")
+		previous = classes[-1:]
+	return count
+
+def count_lines(buffer, end):
+	# the number of line breaks in buffer[:end]
+	count = 0
+	for start in range(0, end, CHUNK_SIZE * 16):
+		count += buffer[start:min(start + CHUNK_SIZE * 16, end)].count(b"\n")
+	return count
+
+def common_prefix(a, b):
+	# a chunk at a time up to the chunk that differs, then byte by byte
+	length = 0
+	end = min(len(a), len(b))
+	while length + CHUNK_SIZE < end and a[length:length + CHUNK_SIZE] == b[length:length + CHUNK_SIZE]:
+		length += CHUNK_SIZE
+	while length < end and a[length] == b[length]:
+		length += 1
+	return length
+
+def read_tokens(buffer):
+	position = 0
+	while position < len(buffer):
+		piece = next_piece(buffer, position)
+		position += len(piece)
+		yield from piece.split()
+
+class TokenStream:
+
+	def __init__(self, expected, compare):
+		# bytes, or a mapped file (see map_file())
+		self.expected_tokens = read_tokens(expected)
+		self.compare = compare
+		self.partial = b""
+		self.matched = 0
+		self.failed = False
+		self.mismatch = None
+
+	def match(self, provided_token):
+		expected_token = next(self.expected_tokens, None)
+		if expected_token is None or not self.compare(expected_token, provided_token):
+			self.fail(expected_token, provided_token)
+		else:
+			self.matched += 1
+		return not self.failed
+
+	def fail(self, expected_token, provided_token):
+		self.failed = True
+		self.mismatch = Mismatch(excerpt(expected_token), excerpt(provided_token), token=self.matched + 1)
+
+	def feed(self, chunk):
+		if self.failed:
+			return False
+		data = self.partial + chunk
+		tokens = data.split()
+		if len(tokens) > 0 and not data[-1:].isspace():
+			self.partial = tokens.pop()
+		else:
+			self.partial = b""
+		for token in tokens:
+			if not self.match(token):
+				return False
+		return True
 
-		def on_finished(exit_code, exit_status):
-			nonlocal callback_called
+	def finish(self):
+		if self.failed:
+			return False
+		if self.partial and not self.match(self.partial):
+			return False
+		expected_token = next(self.expected_tokens, None)
+		if expected_token is not None:
+			self.fail(expected_token, None)
+			return False
+		return True
 
-			if not callback_called:
-				callback_called = True
-				time_taken = str(int((time.time() - start) * 1000)) + "ms"
-				if exit_code == 0 and exit_status == QProcess.NormalExit:
-					callback(Verdict.ACCEPTED, process.readAllStandardOutput().data().decode(), time_taken)
+class ExactTokenStream:
+
+	# For as long as the output is byte for byte the expected output, each
+	# chunk is compared at once with the expected output at its offset, which
+	# takes a memcmp() per chunk rather than a Python object per token. From
+	# the first difference on, the tokens are compared instead, since the
+	# whitespace between them may differ; a token still being written is
+	# compared as it grows. Without case sensitivity, both sides are
+	# lowercased a chunk at a time.
+
+	def __init__(self, expected, case_sensitive=True):
+		# bytes, or a mapped file (see map_file())
+		self.expected = expected
+		self.case_sensitive = case_sensitive
+		# where the part of the expected output still to match starts, which
+		# is always at a token boundary
+		self.position = 0
+		# the output since its last whitespace, possibly the start of a token.
+		# While comparing bytes, that is only counted, as it's the expected
+		# output anyway
+		self.pending = 0
+		self.partial = bytearray()
+		# once comparing tokens: where that started, the expected tokens read
+		# ahead, the next one to match and how many matched so far
+		self.switch_position = None
+		self.tokens = []
+		self.next_token = 0
+		self.matched = 0
+		self.failed = False
+		self.mismatch = None
+
+	def feed(self, chunk):
+		if self.failed:
+			return False
+		if not self.case_sensitive:
+			chunk = chunk.lower()
+		if self.switch_position is None:
+			start = self.position + self.pending
+			expected = self.expected[start:start + len(chunk)]
+			if not self.case_sensitive:
+				expected = expected.lower()
+			if expected == chunk:
+				end = last_whitespace(chunk) + 1
+				if end == 0:
+					self.pending += len(chunk)
 				else:
-					callback(Verdict.RUNTIME_ERROR, process.readAllStandardError().data().decode(), time_taken)
+					self.position = start + end
+					self.pending = len(chunk) - end
+				return True
+			self.switch_tokens()
+
+		end = last_whitespace(chunk) + 1
+		if end > 0:
+			provided_tokens = (bytes(self.partial) + chunk[:end]).split()
+			self.partial = bytearray()
+			if not self.match(provided_tokens):
+				return False
+		return self.extend_partial(chunk[end:])
+
+	def switch_tokens(self):
+		self.switch_position = self.position
+		self.partial = bytearray(self.expected[self.position:self.position + self.pending])
+		if not self.case_sensitive:
+			self.partial = self.partial.lower()
+		self.pending = 0
+
+	def extend_partial(self, data):
+		start = len(self.partial)
+		self.partial += data
+		self.read_ahead(1)
+		if self.next_token < len(self.tokens):
+			expected_token = self.tokens[self.next_token]
+			if len(self.partial) <= len(expected_token) and self.partial[start:] == expected_token[start:len(self.partial)]:
+				return True
+		elif not self.partial:
+			return True
+		return self.match([bytes(self.partial)])
+
+	def finish(self):
+		if self.failed:
+			return False
+		# the last token can't be told apart from the start of a longer one
+		# without looking at the expected tokens
+		if self.switch_position is None:
+			self.switch_tokens()
+		if not self.match(bytes(self.partial).split()):
+			return False
+		self.read_ahead(1)
+		if self.next_token < len(self.tokens):
+			self.fail(self.tokens[self.next_token], None)
+			return False
+		return True
 
-		process.finished.connect(on_finished)
+	def read_ahead(self, count):
+		# reads expected tokens until `count` are left to match, or there are
+		# no more
+		while len(self.tokens) - self.next_token < count and self.position < len(self.expected):
+			piece = next_piece(self.expected, self.position)
+			self.position += len(piece)
+			if not self.case_sensitive:
+				piece = piece.lower()
+			self.tokens = self.tokens[self.next_token:] + piece.split()
+			self.next_token = 0
+
+	def match(self, provided_tokens):
+		self.read_ahead(len(provided_tokens))
+		expected_tokens = self.tokens[self.next_token:self.next_token + len(provided_tokens)]
+		if expected_tokens == provided_tokens:
+			self.next_token += len(provided_tokens)
+			self.matched += len(provided_tokens)
+			return True
+
+		for i in range(len(provided_tokens)):
+			if i >= len(expected_tokens) or expected_tokens[i] != provided_tokens[i]:
+				self.matched += i
+				self.fail(expected_tokens[i] if i < len(expected_tokens) else None, provided_tokens[i])
+				return False
 
-languages = [JavaJudge(), CppJudge(), Python3Judge()]
+	def fail(self, expected_token, provided_token):
+		self.failed = True
+		# the tokens matched a chunk at a time are only counted now
+		token = count_tokens(self.expected, self.switch_position) + self.matched + 1
+		self.mismatch = Mismatch(excerpt(expected_token), excerpt(provided_token), token=token)
 
 class TokenChecker:
 
 	def __init__(self):
 		self.name = "Token Checker"
+		self.key = "token"
 		self.case_sensitive = True
 
 	def check(self, expected, provided):
-		expected_tokens = expected.split()
-		provided_tokens = provided.split()
-		if len(expected_tokens) != len(provided_tokens):
+		stream = ExactTokenStream(expected.encode(), self.case_sensitive)
+		return stream.feed(provided.encode()) and stream.finish()
+
+	def start(self, expected_path):
+		return ExactTokenStream(map_file(expected_path), self.case_sensitive)
+
+class DiffStream:
+
+	# For as long as the output is byte for byte the expected output, each
+	# chunk is compared at once with the expected output at its offset. From
+	# the first difference on, the lines of each chunk are compared as a list,
+	# so that no more than a chunk's worth of lines is ever held, and a line
+	# still without its line break is compared as it grows, so that a
+	# difference in a long line shows right away. A blank line where the
+	# expected output has text is a difference right away; blank lines past
+	# its end are only counted, since trailing ones may have to be ignored.
+
+	def __init__(self, expected, ignore_trailing_whitespace, ignore_trailing_newlines):
+		# bytes, or a mapped file (see map_file())
+		self.expected = expected
+		self.ignore_trailing_whitespace = ignore_trailing_whitespace
+		self.ignore_trailing_newlines = ignore_trailing_newlines
+		# where the part of the expected output still to compare starts
+		self.position = 0
+		# where the output since its last line break starts in it. While
+		# comparing bytes, that is only counted, as it's the expected output
+		# anyway; then it's kept, along with whether it's still the start of
+		# the expected line or that line followed by what normalizing strips
+		self.offset = 0
+		self.pending = 0
+		self.partial = bytearray()
+		self.partial_prefix = True
+		# once comparing lines: where that started, the expected lines read
+		# ahead (as they are and as compared), the next one to compare, and
+		# how many lines of the output have been compared
+		self.switch_position = None
+		self.raw_lines = []
+		self.expected_lines = []
+		self.next_line = 0
+		self.last_line_broken = True
+		self.lines = 0
+		# blank lines of the output past the end of the expected output, and
+		# where the first of them starts
+		self.extra_blank_lines = 0
+		self.extra_blank_offset = None
+		self.failed = False
+		self.mismatch = None
+
+	def normalize(self, lines):
+		if self.ignore_trailing_whitespace:
+			return [line.rstrip() for line in lines]
+		# just the CR of a CRLF line break, as a CR before it would be part of
+		# the line
+		return [line[:-1] if line.endswith(b"\r") else line for line in lines]
+
+	def read_ahead(self, count):
+		# reads expected lines until `count` are left to compare, or there are
+		# no more
+		while len(self.expected_lines) - self.next_line < count and self.position < len(self.expected):
+			piece = next_piece(self.expected, self.position, b"\n")
+			self.position += len(piece)
+			raw_lines = piece.split(b"\n")
+			# only the last line of the expected output can have no line break
+			# after it
+			self.last_line_broken = piece.endswith(b"\n")
+			if self.last_line_broken:
+				raw_lines.pop()
+			self.raw_lines = self.raw_lines[self.next_line:] + raw_lines
+			self.expected_lines = self.expected_lines[self.next_line:] + self.normalize(raw_lines)
+			self.next_line = 0
+
+	def expected_offset(self):
+		# where the next expected line starts
+		unread_lines = self.raw_lines[self.next_line:]
+		if len(unread_lines) == 0:
+			return self.position
+		unread = sum(map(len, unread_lines)) + len(unread_lines) - (not self.last_line_broken)
+		return self.position - unread
+
+	def feed(self, chunk):
+		if self.failed:
 			return False
-		for i in range(len(expected_tokens)):
-			expected_token = expected_tokens[i]
-			provided_token = provided_tokens[i]
-			if self.case_sensitive:
-				if expected_token != provided_token:
+		if self.switch_position is None:
+			start = self.position + self.pending
+			if self.expected[start:start + len(chunk)] == chunk:
+				end = chunk.rfind(b"\n") + 1
+				if end == 0:
+					self.pending += len(chunk)
+				else:
+					self.position = start + end
+					self.offset += self.pending + end
+					self.pending = len(chunk) - end
+				return True
+			self.switch_lines()
+			chunk = bytes(self.partial) + chunk
+			self.partial = bytearray()
+
+		end = chunk.rfind(b"\n")
+		if end != -1:
+			raw_lines = chunk[:end].split(b"\n")
+			raw_lines[0] = bytes(self.partial) + raw_lines[0]
+			self.partial = bytearray()
+			self.partial_prefix = True
+			if not self.match(raw_lines):
+				return False
+		return self.extend_partial(chunk[end + 1:])
+
+	def switch_lines(self):
+		self.switch_position = self.position
+		self.partial = bytearray(self.expected[self.position:self.position + self.pending])
+		self.pending = 0
+
+	def extend_partial(self, data):
+		start = len(self.partial)
+		self.partial += data
+		self.read_ahead(1)
+		# past the end of the expected output, only a blank line can match
+		expected_line = self.expected_lines[self.next_line] if self.next_line < len(self.expected_lines) else b""
+		if self.partial_prefix:
+			if len(self.partial) <= len(expected_line):
+				if self.partial[start:] == expected_line[start:len(self.partial)]:
+					return True
+			elif self.partial[start:len(expected_line)] == expected_line[start:]:
+				self.partial_prefix = False
+			data = self.partial[max(start, len(expected_line)):]
+		if self.partial_prefix:
+			return self.match([bytes(self.partial)])
+		# what follows the expected line has to be stripped away for the line to
+		# match, and if it isn't the line is compared as it is. Only one CR is
+		# stripped, so that is checked for all of it rather than for what's new
+		if self.ignore_trailing_whitespace:
+			strippable = not data.rstrip()
+		else:
+			strippable = self.partial[len(expected_line):] in (b"", b"\r")
+		if not strippable:
+			return self.match([bytes(self.partial)])
+		return True
+
+	def match(self, raw_lines):
+		provided_lines = self.normalize(raw_lines)
+		count = len(provided_lines)
+		self.read_ahead(count)
+		if self.expected_lines[self.next_line:self.next_line + count] == provided_lines:
+			self.next_line += count
+			self.lines += count
+			self.offset += sum(map(len, raw_lines)) + count
+			return True
+
+		# the lines before the one that differs match
+		for raw_line, provided_line in zip(raw_lines, provided_lines):
+			self.lines += 1
+			if self.next_line < len(self.expected_lines):
+				expected_line = self.expected_lines[self.next_line]
+				if expected_line != provided_line:
+					self.fail(expected_line, provided_line, self.lines, self.expected_offset(), self.offset)
 					return False
+				self.next_line += 1
+			elif provided_line == b"":
+				if self.extra_blank_lines == 0:
+					self.extra_blank_offset = self.offset
+				self.extra_blank_lines += 1
 			else:
-				if expected_token.lower() != provided_token.lower():
-					return False
+				self.fail(None, provided_line, self.lines, len(self.expected), self.offset)
+				return False
+			self.offset += len(raw_line) + 1
+		return True
+
+	def finish(self):
+		if self.failed:
+			return False
+		if self.switch_position is None:
+			self.switch_lines()
+		if self.partial:
+			if not self.match([bytes(self.partial)]):
+				return False
+			# there's no line break after it
+			self.offset -= 1
+
+		# only blank lines may be left of the expected output now
+		expected_blank_lines = 0
+		first_blank_offset = None
+		while True:
+			self.read_ahead(1)
+			if self.next_line == len(self.expected_lines):
+				break
+			if self.expected_lines[self.next_line] != b"":
+				self.fail(self.expected_lines[self.next_line], None, self.lines + expected_blank_lines + 1, self.expected_offset(), self.offset)
+				return False
+			if first_blank_offset is None:
+				first_blank_offset = self.expected_offset()
+			expected_blank_lines += 1
+			self.next_line += 1
+
+		if self.ignore_trailing_newlines:
+			return True
+		if expected_blank_lines > 0:
+			self.fail(b"", None, self.lines + 1, first_blank_offset, self.offset)
+			return False
+		if self.extra_blank_lines > 0:
+			self.fail(None, b"", self.lines - self.extra_blank_lines + 1, len(self.expected), self.extra_blank_offset)
+			return False
 		return True
 
+	def fail(self, expected_line, provided_line, line, expected_offset, provided_offset):
+		self.failed = True
+		column = None
+		start = 0
+		if expected_line is not None and provided_line is not None:
+			column = common_prefix(expected_line, provided_line) + 1
+			# the quoted lines start a little before the difference
+			start = max(column - 1 - EXCERPT_LENGTH // 2, 0)
+		# the lines matched a chunk at a time are only counted now
+		line += count_lines(self.expected, self.switch_position)
+		self.mismatch = Mismatch(
+			excerpt(expected_line, start),
+			excerpt(provided_line, start),
+			line=line,
+			column=column,
+			expected_offset=expected_offset,
+			provided_offset=provided_offset,
+		)
+
 class DiffChecker:
 
 	def __init__(self):
 		self.name = "Diff Checker"
+		self.key = "diff"
 		self.ignore_trailing_whitespace = True
 		self.ignore_trailing_newlines = True
 
 	def check(self, expected, provided):
-		expected_lines = expected.splitlines()
-		provided_lines = provided.splitlines()
-
-		if self.ignore_trailing_whitespace:
-			for i in range(len(expected_lines)):
-				expected_lines[i] = expected_lines[i].rstrip()
-			for i in range(len(provided_lines)):
-				provided_lines[i] = provided_lines[i].rstrip()
-
-		if self.ignore_trailing_newlines:
-			while expected_lines[-1] == "":
-				expected_lines.pop()
-			while provided_lines[-1] == "":
-				provided_lines.pop()
-
-		if len(expected_lines) != len(provided_lines):
+		stream = DiffStream(expected.encode(), self.ignore_trailing_whitespace, self.ignore_trailing_newlines)
+		return stream.feed(provided.encode()) and stream.finish()
+
+	def start(self, expected_path):
+		return DiffStream(map_file(expected_path), self.ignore_trailing_whitespace, self.ignore_trailing_newlines)
+
+def load_numpy():
+	# whether numpy is available, importing it the first time
+	global numpy
+	if numpy is None:
+		try:
+			import numpy
+		except ImportError:
+			numpy = False
+	return numpy is not False
+
+def parse_numbers(data):
+	# The tokens in data as an array of doubles, along with an array telling
+	# which of them aren't numbers, which are NaN in the first.
+	# numpy reads nothing but whitespace as a -1
+	if data.isspace():
+		data = b""
+	try:
+		# older versions of numpy warn and stop at the first token that isn't
+		# a number, newer ones raise
+		with warnings.catch_warnings(record=True) as caught:
+			warnings.simplefilter("always", DeprecationWarning)
+			values = numpy.fromstring(data, sep=" ")
+		if len(caught) == 0:
+			return values, numpy.zeros(len(values), dtype=bool)
+	except ValueError:
+		pass
+
+	tokens = data.split()
+	values = numpy.full(len(tokens), numpy.nan)
+	not_numbers = numpy.zeros(len(tokens), dtype=bool)
+	for i, token in enumerate(tokens):
+		try:
+			values[i] = float(token)
+		except ValueError:
+			not_numbers[i] = True
+	return values, not_numbers
+
+class EpsilonStream:
+
+	# Parses each chunk of the output and of the expected output into an array
+	# of doubles in one go and compares them with array operations, instead of
+	# parsing and comparing a token at a time. Only chunks holding something
+	# other than numbers are parsed a token at a time. Like numbers_close(),
+	# a token that isn't a number matches anything.
+
+	def __init__(self, expected, relative_epsilon, absolute_epsilon):
+		# bytes, or a mapped file (see map_file())
+		self.expected = expected
+		self.relative_epsilon = relative_epsilon
+		self.absolute_epsilon = absolute_epsilon
+		self.position = 0
+		self.partial = b""
+		# the expected numbers read ahead, and the next one to match
+		self.values = numpy.empty(0)
+		self.not_numbers = numpy.zeros(0, dtype=bool)
+		self.next_value = 0
+		self.matched = 0
+		self.failed = False
+		self.mismatch = None
+
+	def feed(self, chunk):
+		if self.failed:
+			return False
+		data = self.partial + chunk
+		end = last_whitespace(data) + 1
+		self.partial = data[end:]
+		if end == 0:
+			return True
+		return self.match(data[:end])
+
+	def finish(self):
+		if self.failed:
+			return False
+		if not self.match(self.partial):
+			return False
+		self.read_ahead(1)
+		if self.next_value < len(self.values):
+			self.fail(0, None)
 			return False
-		for i in range(len(expected_lines)):
-			expected_line = expected_lines[i]
-			provided_line = provided_lines[i]
-			if expected_line != provided_line:
-				return False
 		return True
 
+	def read_ahead(self, count):
+		while len(self.values) - self.next_value < count and self.position < len(self.expected):
+			piece = next_piece(self.expected, self.position)
+			self.position += len(piece)
+			values, not_numbers = parse_numbers(piece)
+			self.values = numpy.concatenate((self.values[self.next_value:], values))
+			self.not_numbers = numpy.concatenate((self.not_numbers[self.next_value:], not_numbers))
+			self.next_value = 0
+
+	def match(self, data):
+		provided_values, provided_not_numbers = parse_numbers(data)
+		count = len(provided_values)
+		self.read_ahead(count)
+		expected_values = self.values[self.next_value:self.next_value + count]
+		expected_not_numbers = self.not_numbers[self.next_value:self.next_value + count]
+		available = len(expected_values)
+
+		# the same conditions as numbers_close()
+		# infinities and NaN never count as close, without a warning
+		with numpy.errstate(divide="ignore", invalid="ignore", over="ignore"):
+			difference = numpy.abs(expected_values - provided_values[:available])
+			close = difference / numpy.abs(expected_values) <= self.relative_epsilon
+		close |= difference <= self.absolute_epsilon
+		close |= expected_not_numbers | provided_not_numbers[:available]
+
+		if available == count and close.all():
+			self.next_value += count
+			self.matched += count
+			return True
+
+		# the expected output ends where its numbers do, if nothing differs
+		# before that
+		index = int(numpy.argmin(close)) if not close.all() else available
+		self.fail(index, data.split()[index])
+		return False
+
+	def fail(self, index, provided_token):
+		self.failed = True
+		token = self.matched + index + 1
+		self.mismatch = Mismatch(excerpt(find_token(self.expected, token)), excerpt(provided_token), token=token)
+
 class EpsilonChecker:
 
 	def __init__(self):
 		self.name = "Epsilon Checker"
+		self.key = "epsilon"
 		self.relative_epsilon = 1e-6
 		self.absolute_epsilon = 1e-6
 
-	def check(self, expected, provided):
-		expected_tokens = expected.split()
-		provided_tokens = provided.split()
-		if len(expected_tokens) != len(provided_tokens):
-			return False
-		for i in range(len(expected_tokens)):
-			expected_token = expected_tokens[i]
-			provided_token = provided_tokens[i]
-			try:
-				expected_num = float(expected_token)
-				provided_num = float(provided_token)
-
-				if abs(expected_num) > 0:
-					within_threshold = abs((expected_num - provided_num) / expected_num) <= self.relative_epsilon
-				else:
-					within_threshold = False
+	def numbers_close(self, expected_token, provided_token):
+		try:
+			expected_num = float(expected_token)
+			provided_num = float(provided_token)
 
-				if not within_threshold:
-					within_threshold = abs(expected_num - provided_num) <= self.absolute_epsilon
+			if abs(expected_num) > 0:
+				within_threshold = abs((expected_num - provided_num) / expected_num) <= self.relative_epsilon
+			else:
+				within_threshold = False
 
-				if not within_threshold:
-					return False
-			except ValueError:
-				pass
-		return True
+			if not within_threshold:
+				within_threshold = abs(expected_num - provided_num) <= self.absolute_epsilon
+
+			return within_threshold
+		except ValueError:
+			return True
+
+	def stream(self, expected):
+		if load_numpy():
+			return EpsilonStream(expected, self.relative_epsilon, self.absolute_epsilon)
+		return TokenStream(expected, self.numbers_close)
+
+	def check(self, expected, provided):
+		stream = self.stream(expected.encode())
+		return stream.feed(provided.encode()) and stream.finish()
+
+	def start(self, expected_path):
+		return self.stream(map_file(expected_path))
 
 checkers = [TokenChecker(), DiffChecker(), EpsilonChecker()]
 
-def find_cases(root_dir):
-	files = []
-	for p in Path(root_dir).iterdir():
-		if p.is_dir():
-			yield from find_cases(p)
-		elif p.is_file():
-			files.append(p.resolve())
-
-	input_file = list(filter(lambda x: x.name.endswith(".in"), files))
-	output_file = list(filter(lambda x: x.name.endswith(".out"), files))
-	if len(input_file) == 1 and len(output_file) == 1:
-		yield (input_file[0], output_file[0])
-	else:
-		input_files = dict()
-		for file in files:
-			if file.name.endswith(".in"):
-				input_files[file.name[:-3]] = file
-		for file in files:
-			if file.name.endswith(".out") and file.name[:-4] in input_files:
-				yield (input_files[file.name[:-4]], file)
+def find_cases(root_dir, index=None):
+	# Yields (input path, expected output path) for every test found under
+	# root_dir, as it's found. With an index (see caseindex.py), directories
+	# that haven't changed since they were last searched aren't listed again.
+	yield from search(os.path.realpath(root_dir), index)
+	if index is not None:
+		index.save()
+
+def search(directory, index):
+	listing = index.lookup(directory) if index is not None else None
+	if listing is None:
+		subdirs = []
+		files = []
+		# the type of each entry comes with the listing on most file systems,
+		# so this is one system call per directory rather than a few per file
+		with os.scandir(directory) as it:
+			for entry in it:
+				if entry.is_dir():
+					subdirs.append(entry.name)
+				elif entry.is_file():
+					files.append(entry.name)
+		listing = (subdirs, pair_cases(files))
+		if index is not None:
+			index.store(directory, *listing)
+
+	subdirs, cases = listing
+	for name in subdirs:
+		yield from search(os.path.join(directory, name), index)
+	for input_name, output_name in cases:
+		yield (os.path.join(directory, input_name), os.path.join(directory, output_name))
+
+def pair_cases(files):
+	input_files = [name for name in files if name.endswith(".in")]
+	output_files = [name for name in files if name.endswith(".out")]
+	if len(input_files) == 1 and len(output_files) == 1:
+		return [(input_files[0], output_files[0])]
+
+	input_names = set(name[:-3] for name in input_files)
+	return [(name[:-4] + ".in", name) for name in output_files if name[:-4] in input_names]
@@ -4,21 +4,30 @@ from PyQt5.QtWidgets import (
 	QLabel,
 	QPushButton,
 	QDoubleSpinBox,
+	QSpinBox,
 	QLineEdit,
 	QScrollArea,
 	QGridLayout,
 	QComboBox,
+	QCheckBox,
 	QFileDialog,
 	QHBoxLayout,
 	QMessageBox,
 	QDesktopWidget,
 )
 
-from judge import languages, checkers, find_cases
+from judge import languages, checkers
+from engine import Limits
 from os.path import exists, isdir
+from os import cpu_count
 from pathlib import Path
 from outputviewer import OutputViewerWindow, FileData
 from results import ResultsWindow
+import runner
+
+def megabytes(value):
+	# 0 stands for no limit
+	return value * 1024 * 1024 if value > 0 else None
 
 class OptionsWindow(QMainWindow):
 
@@ -92,24 +101,110 @@ class OptionsWindow(QMainWindow):
 		self.time_limit.setMinimum(0.1)
 		layout.addWidget(self.time_limit, 3, 1)
 
-		layout.addWidget(QLabel("Checker:"), 4, 0)
+		layout.addWidget(QLabel("Time limit applies to:"), 4, 0)
+
+		self.time_mode_selector = QComboBox()
+		self.time_mode_selector.addItems(["CPU time", "Wall time"])
+		layout.addWidget(self.time_mode_selector, 4, 1)
+
+		layout.addWidget(QLabel("Time limit excludes startup:"), 5, 0)
+
+		self.exclude_startup = QCheckBox()
+		layout.addWidget(self.exclude_startup, 5, 1)
+
+		layout.addWidget(QLabel("Memory limit (in MB):"), 6, 0)
+
+		self.memory_limit = QSpinBox()
+		self.memory_limit.setMaximum(65536)
+		self.memory_limit.setValue(256)
+		self.memory_limit.setSpecialValueText("Unlimited")
+		layout.addWidget(self.memory_limit, 6, 1)
+
+		layout.addWidget(QLabel("Stack limit (in MB):"), 7, 0)
+
+		self.stack_limit = QSpinBox()
+		self.stack_limit.setMaximum(65536)
+		# threads' stacks are as large as the main thread's, so by default the
+		# system's stack limit is left as it is (see Limits.data_limit())
+		self.stack_limit.setValue(0)
+		self.stack_limit.setSpecialValueText("System default")
+		layout.addWidget(self.stack_limit, 7, 1)
+
+		layout.addWidget(QLabel("Output limit (in MB):"), 8, 0)
+
+		self.output_limit = QSpinBox()
+		self.output_limit.setMaximum(65536)
+		self.output_limit.setValue(64)
+		self.output_limit.setSpecialValueText("Unlimited")
+		layout.addWidget(self.output_limit, 8, 1)
+
+		layout.addWidget(QLabel("Checker:"), 9, 0)
 
 		self.checker_selector = QComboBox()
 		self.checker_selector.addItems(map(lambda x: x.name, checkers))
-		layout.addWidget(self.checker_selector, 4, 1)
+		layout.addWidget(self.checker_selector, 9, 1)
+
+		layout.addWidget(QLabel("Parallel runs:"), 10, 0)
+
+		self.parallel_runs = QSpinBox()
+		self.parallel_runs.setMinimum(1)
+		self.parallel_runs.setMaximum(256)
+		self.parallel_runs.setValue(cpu_count() or 1)
+		layout.addWidget(self.parallel_runs, 10, 1)
+
+		layout.addWidget(QLabel("Spool output to disk:"), 11, 0)
+
+		self.spool = QCheckBox()
+		layout.addWidget(self.spool, 11, 1)
+
+		layout.addWidget(QLabel("Measure JIT warm-up (PyPy):"), 12, 0)
+
+		self.jit_probe = QCheckBox()
+		layout.addWidget(self.jit_probe, 12, 1)
+
+		layout.addWidget(QLabel("Benchmark runs per test:"), 13, 0)
 
-		# layout.addWidget(QLabel("Case sensitive:"), 5, 0)
-		# layout.addWidget(QLineEdit("test"), 5, 1)
+		self.benchmark_runs = QSpinBox()
+		self.benchmark_runs.setMinimum(1)
+		self.benchmark_runs.setMaximum(1000)
+		self.benchmark_runs.setValue(1)
+		self.benchmark_runs.setSpecialValueText("Off")
+		layout.addWidget(self.benchmark_runs, 13, 1)
+
+		layout.addWidget(QLabel("Benchmark warm-up runs:"), 14, 0)
+
+		self.warmup_runs = QSpinBox()
+		self.warmup_runs.setMaximum(100)
+		layout.addWidget(self.warmup_runs, 14, 1)
+
+		layout.addWidget(QLabel("Reuse results of unchanged tests:"), 15, 0)
+
+		self.reuse = QCheckBox()
+		self.reuse.setChecked(True)
+		layout.addWidget(self.reuse, 15, 1)
+
+		layout.addWidget(QLabel("Stop at the first failure:"), 16, 0)
+
+		self.fail_fast = QCheckBox()
+		layout.addWidget(self.fail_fast, 16, 1)
+
+		layout.addWidget(QLabel("Watch for changes:"), 17, 0)
+
+		self.watch = QCheckBox()
+		layout.addWidget(self.watch, 17, 1)
+
+		# layout.addWidget(QLabel("Case sensitive:"), 18, 0)
+		# layout.addWidget(QLineEdit("test"), 18, 1)
 
 		btn_layout = QHBoxLayout()
 
 		self.judge_btn = QPushButton("Judge")
 		btn_layout.addWidget(self.judge_btn, 5)
 
-		layout.addLayout(btn_layout, 6, 0, 1, 3)
+		layout.addLayout(btn_layout, 19, 0, 1, 3)
 
-		layout.addWidget(QWidget(), 7, 0)
-		layout.setRowStretch(7, 1)
+		layout.addWidget(QWidget(), 20, 0)
+		layout.setRowStretch(20, 1)
 
 		self.resize(640, self.sizeHint().height())
 
@@ -129,34 +224,93 @@ class OptionsWindow(QMainWindow):
 			QMessageBox.warning(self, "Directory not found", "The provided path to the data directory doesn't name a directory")
 			return
 
-		tests = list(find_cases(data_path))
-		if len(tests) == 0:
-			QMessageBox.warning(self, "No test cases", "The provided path to the data directory doesn't contain any test cases")
-			return
-
 		language = languages[self.language_selector.currentIndex()]
 
 		self.judge_btn.setText("Compiling...")
 		self.judge_btn.setDisabled(True)
 
+		# the data directory is searched while the solution compiles, and
+		# cases found after the results window opens are added to it
+		tests = []
+		searching = True
+		results = None
+
+		def cases_callback(cases):
+			tests.extend(cases)
+			if results is not None:
+				results.add_tests(cases)
+
+		def search_callback(error):
+			nonlocal searching
+			searching = False
+			if results is not None:
+				results.finish_search()
+			if error is not None:
+				QMessageBox.warning(self, "Couldn't search the data directory", str(error))
+			elif len(tests) == 0:
+				QMessageBox.warning(self, "No test cases", "The provided path to the data directory doesn't contain any test cases")
+			if len(tests) == 0 and results is not None:
+				results.close()
+
 		def compile_callback(success, output, cmd):
-			self.judge_btn.setText("Judge")
-			self.judge_btn.setDisabled(False)
+			if not searching and len(tests) == 0:
+				self.judge_btn.setText("Judge")
+				self.judge_btn.setDisabled(False)
+				return
 
 			if not success:
+				self.judge_btn.setText("Judge")
+				self.judge_btn.setDisabled(False)
 				self.viewer = OutputViewerWindow(FileData("stderr", cmd, output, ansi=True))
 				self.viewer.show()
-			else:
-				self.results = ResultsWindow(
+				return
+
+			# the first judge with a language measures its startup time
+			self.judge_btn.setText("Calibrating...")
+
+			def calibrate_callback(overhead):
+				nonlocal results
+				self.judge_btn.setText("Judge")
+				self.judge_btn.setDisabled(False)
+				if not searching and len(tests) == 0:
+					return
+
+				cpu_time = self.time_mode_selector.currentIndex() == 0
+				startup_time = overhead.time(cpu_time) if overhead is not None else None
+
+				results = ResultsWindow(
 					compiled_file=output,
-					tests=tests,
+					tests=list(tests),
 					language=language,
-					time_limit=self.time_limit.value(),
+					limits=Limits(
+						time_limit=self.time_limit.value(),
+						cpu_time=cpu_time,
+						memory_limit=megabytes(self.memory_limit.value()),
+						stack_limit=megabytes(self.stack_limit.value()),
+						output_limit=megabytes(self.output_limit.value()),
+						startup_time=startup_time if startup_time is not None and self.exclude_startup.isChecked() else 0,
+					),
 					checker=checkers[self.checker_selector.currentIndex()],
+					parallel_runs=self.parallel_runs.value(),
+					spool=self.spool.isChecked(),
+					jit_probe=self.jit_probe.isChecked(),
+					benchmark_runs=self.benchmark_runs.value() if self.benchmark_runs.value() > 1 else None,
+					warmup_runs=self.warmup_runs.value(),
+					reuse=self.reuse.isChecked(),
+					solution_path=solution_path,
+					fail_fast=self.fail_fast.isChecked(),
+					startup_time=startup_time,
+					searching=searching,
+					watch=self.watch.isChecked(),
+					data_path=data_path,
 				)
+				self.results = results
 				self.results.showMaximized()
 
-		language.compile(solution_path, compile_callback)
+			runner.calibrate(language, calibrate_callback)
+
+		runner.discover(data_path, cases_callback, search_callback)
+		runner.compile(language, solution_path, compile_callback)
 
 	def center(self):
 		qr = self.frameGeometry()
@@ -13,6 +13,7 @@ from PyQt5.QtCore import Qt, QProcess
 import ansi2html.converter
 import ansi2html.style
 import tmp
+import shutil
 import io
 import re
 import html
@@ -21,17 +22,77 @@ converter = ansi2html.converter.Ansi2HTMLConverter(inline=True)
 
 MAX_LEN = 1024*32
 
+# lines shown on either side of the first difference
+CONTEXT_LINES = 3
+
+# how much is read on either side of it to find them
+CONTEXT_BYTES = 4096
+
 class FileData:
 
-	def __init__(self, filename, header, content, ansi):
+	def __init__(self, filename, header, content, ansi, path=None):
 		self.filename = filename
 		self.header = header
 		self.content = content
 		self.ansi = ansi
+		# set when the data lives on disk; content then only holds its beginning
+		self.path = path
+
+def read_head(path):
+	with io.open(path, "r", errors="replace") as file:
+		return file.read(MAX_LEN + 1)
+
+def read_around(file: FileData, offset):
+	# The file's contents from a little before offset to a little after, as
+	# (bytes, where they start), or None if they don't reach that far.
+	start = max(offset - CONTEXT_BYTES, 0)
+	if file.path is not None:
+		with io.open(file.path, "rb") as f:
+			f.seek(start)
+			data = f.read(offset - start + CONTEXT_BYTES)
+	else:
+		data = file.content.encode(errors="replace")[start:offset + CONTEXT_BYTES]
+	if start + len(data) < offset:
+		return None
+	return data, start
+
+def context_html(file: FileData, offset, line):
+	# the lines around the one starting at offset, numbered, with that one
+	# highlighted
+	around = read_around(file, offset)
+	if around is None:
+		return None
+	data, start = around
+	before = data[:offset - start].split(b"\n")[:-1][-CONTEXT_LINES:]
+	after = data[offset - start:].split(b"\n")[:CONTEXT_LINES + 1]
+
+	rows = []
+	for i, text in enumerate(before + after):
+		number = line - len(before) + i
+		row = html.escape("%6d  %s" % (number, text.rstrip(b"\r").decode(errors="replace")))
+		if number == line:
+			row = '<span style="background-color: #c00; color: white;">' + row + "</span>"
+		rows.append(row)
+	return "\n".join(rows)
+
+def code_label(header, content_html):
+	label = QLabel()
+	label.setWordWrap(True)
+	label.setTextInteractionFlags(Qt.TextBrowserInteraction)
+	label.setCursor(Qt.IBeamCursor)
+	label.setAlignment(Qt.AlignTop)
+	label.setProperty("class", "monospaced")
+	label.setTextFormat(Qt.RichText)
+	label.setText("<pre><b>%s</b><hr>\n%s</pre>" % (html.escape(header), content_html))
+	return label
 
 class DiffViewer(QScrollArea):
 
-	def __init__(self, file_left: FileData, file_right: FileData):
+	# With a mismatch that says where the differing lines start (see
+	# judge.py), the lines around them are shown above the beginning of
+	# either file, which may not reach that far.
+
+	def __init__(self, file_left: FileData, file_right: FileData, mismatch=None):
 		super(DiffViewer, self).__init__()
 
 		self.setVerticalScrollBarPolicy(Qt.ScrollBarAsNeeded)
@@ -46,33 +107,26 @@ class DiffViewer(QScrollArea):
 		full_content_left = file_left.content
 		full_content_right = file_right.content
 
+		context_container = None
+		if mismatch is not None and mismatch.expected_offset is not None:
+			context_left = context_html(file_left, mismatch.expected_offset, mismatch.line)
+			context_right = context_html(file_right, mismatch.provided_offset, mismatch.line)
+			if context_left is not None and context_right is not None:
+				context_container = QHBoxLayout()
+				context_container.addWidget(code_label(file_left.header + " around line " + str(mismatch.line), context_left), stretch=1)
+				context_container.addWidget(code_label(file_right.header + " around line " + str(mismatch.line), context_right), stretch=1)
+
 		if len(file_left.content) > MAX_LEN:
 			file_left.content = file_left.content[0:MAX_LEN] + " ... (file is too large to display)"
 
 		if len(file_right.content) > MAX_LEN:
 			file_right.content = file_right.content[0:MAX_LEN] + " ... (file is too large to display)"
 
-		label_left = QLabel()
-		label_left.setWordWrap(True)
-		label_left.setTextInteractionFlags(Qt.TextBrowserInteraction)
-		label_left.setCursor(Qt.IBeamCursor)
-		label_left.setAlignment(Qt.AlignTop)
-		label_left.setProperty("class", "monospaced")
-		label_left.setTextFormat(Qt.RichText)
 		content_html_left = converter.convert(file_left.content, False) if file_left.ansi else html.escape(file_left.content)
-		label_left.setText("<pre><b>%s</b><hr>\n%s</pre>" % (html.escape(file_left.header), content_html_left))
-		diff_container.addWidget(label_left, stretch=1)
-
-		label_right = QLabel()
-		label_right.setWordWrap(True)
-		label_right.setTextInteractionFlags(Qt.TextBrowserInteraction)
-		label_right.setCursor(Qt.IBeamCursor)
-		label_right.setAlignment(Qt.AlignTop)
-		label_right.setProperty("class", "monospaced")
-		label_right.setTextFormat(Qt.RichText)
+		diff_container.addWidget(code_label(file_left.header, content_html_left), stretch=1)
+
 		content_html_right = converter.convert(file_right.content, False) if file_right.ansi else html.escape(file_right.content)
-		label_right.setText("<pre><b>%s</b><hr>\n%s</pre>" % (html.escape(file_right.header), content_html_right))
-		diff_container.addWidget(label_right, stretch=1)
+		diff_container.addWidget(code_label(file_right.header, content_html_right), stretch=1)
 
 		button_container = QHBoxLayout()
 
@@ -84,13 +138,19 @@ class DiffViewer(QScrollArea):
 			tmp_file_left = tmp.mktmp(file_left.filename)
 			tmp_file_right = tmp.mktmp(file_right.filename)
 
-			file = io.open(tmp_file_left, "w")
-			file.write(html.unescape(re.sub(r"<.*?>", "", content_html_left)) if file_left.ansi else full_content_left)
-			file.close()
+			if file_left.path is not None:
+				shutil.copyfile(file_left.path, tmp_file_left)
+			else:
+				file = io.open(tmp_file_left, "w")
+				file.write(html.unescape(re.sub(r"<.*?>", "", content_html_left)) if file_left.ansi else full_content_left)
+				file.close()
 
-			file = io.open(tmp_file_right, "w")
-			file.write(html.unescape(re.sub(r"<.*?>", "", content_html_right)) if file_right.ansi else full_content_right)
-			file.close()
+			if file_right.path is not None:
+				shutil.copyfile(file_right.path, tmp_file_right)
+			else:
+				file = io.open(tmp_file_right, "w")
+				file.write(html.unescape(re.sub(r"<.*?>", "", content_html_right)) if file_right.ansi else full_content_right)
+				file.close()
 
 			process.startDetached("code", ["-d", tmp_file_left, tmp_file_right])
 
@@ -100,6 +160,8 @@ class DiffViewer(QScrollArea):
 		button_container.addStretch()
 
 		layout = QVBoxLayout(container)
+		if context_container is not None:
+			layout.addLayout(context_container)
 		layout.addLayout(diff_container, stretch=1)
 		layout.addLayout(button_container)
 
@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import os
+
+# Asks the kernel to start reading the files of the tests that are up next
+# while the current ones run, so that neither a test's run nor showing its
+# result waits on the disk. Files are only read ahead into the page cache,
+# never into veryfire's memory, so any number of them can be requested.
+
+# how many tests past the ones running to read ahead
+PREFETCH_DEPTH = 8
+
+class Prefetcher:
+
+	def __init__(self):
+		# one thread, since the disk reads ahead one file at a time anyway
+		self.executor = ThreadPoolExecutor(max_workers=1)
+		self.lock = threading.Lock()
+		# files requested but not yet read ahead
+		self.pending = set()
+
+	def prefetch(self, tests):
+		for test in tests:
+			for path in test:
+				path = str(path)
+				with self.lock:
+					if path in self.pending:
+						continue
+					self.pending.add(path)
+				self.executor.submit(self.read_ahead, path)
+
+	def read_ahead(self, path):
+		try:
+			read_ahead(path)
+		finally:
+			with self.lock:
+				self.pending.discard(path)
+
+def read_ahead(path):
+	try:
+		fd = os.open(path, os.O_RDONLY)
+	except OSError:
+		return
+	try:
+		if hasattr(os, "posix_fadvise"):
+			os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+		else:
+			# without fadvise (macOS), reading the file through has the same
+			# effect
+			while os.read(fd, 1024 * 1024):
+				pass
+	except OSError:
+		pass
+	finally:
+		os.close(fd)
@@ -0,0 +1,127 @@
+from judge import Verdict, Mismatch, CHUNK_SIZE
+from engine import RunResult
+from cache import cache_root
+import hashlib
+import threading
+import sqlite3
+import shutil
+import json
+import time
+import os
+
+# Results of earlier runs, kept so that judging a solution again only runs the
+# tests whose result could come out differently. A result is reused when the
+# program (byte for byte, along with the interpreter running it), the input,
+# the expected output, the checker's settings and the limits are all the same.
+# Hashes of files are remembered along with their size and modification time,
+# so that unchanged tests aren't read again to find out they're unchanged.
+# The engine calls into this from worker threads, to keep reading files off
+# its event loop, so the database is only used under a lock.
+
+# enough of the output for the results window to show (see outputviewer.py)
+MAX_OUTPUT = 32 * 1024 + 1
+
+# results that haven't been used for the longest are dropped past this many
+MAX_RESULTS = 200_000
+
+class ResultCache:
+
+	def __init__(self, path=None):
+		self.path = path or os.path.join(cache_root(), "results.sqlite3")
+		self.connection = None
+		self.lock = threading.RLock()
+
+	def connect(self):
+		if self.connection is None:
+			os.makedirs(os.path.dirname(self.path), exist_ok=True)
+			self.connection = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+			self.connection.executescript("""
+				PRAGMA journal_mode = WAL;
+				PRAGMA synchronous = NORMAL;
+				CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, result TEXT NOT NULL, used REAL NOT NULL);
+				CREATE TABLE IF NOT EXISTS file_hashes (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime INTEGER NOT NULL, hash TEXT NOT NULL);
+			""")
+			with self.connection:
+				self.connection.execute("DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY used DESC LIMIT -1 OFFSET ?)", (MAX_RESULTS,))
+		return self.connection
+
+	def file_hash(self, path):
+		path = os.path.abspath(path)
+		stat = os.stat(path)
+		with self.lock:
+			row = self.connect().execute("SELECT hash FROM file_hashes WHERE path = ? AND size = ? AND mtime = ?", (path, stat.st_size, stat.st_mtime_ns)).fetchone()
+		if row is not None:
+			return row[0]
+
+		digest = hashlib.sha256()
+		with open(path, "rb") as file:
+			while True:
+				chunk = file.read(CHUNK_SIZE)
+				if not chunk:
+					break
+				digest.update(chunk)
+		with self.lock, self.connect() as connection:
+			connection.execute("INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)", (path, stat.st_size, stat.st_mtime_ns, digest.hexdigest()))
+		return digest.hexdigest()
+
+	def key(self, language, compiled_file, test, checker, limits):
+		parts = [language.key, self.file_hash(compiled_file)]
+
+		# compiled programs run by themselves, the rest depend on whatever
+		# runs them
+		tool = shutil.which(language.run_command(compiled_file)[0])
+		if tool is not None and os.path.abspath(tool) != os.path.abspath(compiled_file):
+			parts.append(tool + ":" + str(os.stat(tool).st_mtime_ns))
+
+		parts.append(self.file_hash(test[0]))
+		parts.append(self.file_hash(test[1]))
+		parts.append(json.dumps(vars(checker), sort_keys=True, default=str))
+		parts.append(json.dumps(vars(limits), sort_keys=True, default=str))
+		return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+	def lookup(self, key):
+		with self.lock:
+			connection = self.connect()
+			row = connection.execute("SELECT result FROM results WHERE key = ?", (key,)).fetchone()
+			if row is None:
+				return None
+			with connection:
+				connection.execute("UPDATE results SET used = ? WHERE key = ?", (time.time(), key))
+
+		fields = json.loads(row[0])
+		result = RunResult(
+			Verdict[fields["verdict"]],
+			fields["output"],
+			fields["time_taken"],
+			wall_time=fields["wall_time"],
+			user_time=fields["user_time"],
+			system_time=fields["system_time"],
+			peak_memory=fields["peak_memory"],
+			peak_memory_exact=fields["peak_memory_exact"],
+		)
+		result.cached = True
+		if fields.get("mismatch") is not None:
+			result.mismatch = Mismatch(**fields["mismatch"])
+		return result
+
+	def store(self, key, result):
+		output = result.output
+		if result.output_file is not None:
+			with open(result.output_file, "r", errors="replace") as file:
+				output = file.read(MAX_OUTPUT)
+		elif output is not None:
+			output = output[:MAX_OUTPUT]
+
+		fields = {
+			"verdict": result.verdict.name,
+			"output": output,
+			"time_taken": result.time_taken,
+			"wall_time": result.wall_time,
+			"user_time": result.user_time,
+			"system_time": result.system_time,
+			"peak_memory": result.peak_memory,
+			"peak_memory_exact": result.peak_memory_exact,
+			"mismatch": vars(result.mismatch) if result.mismatch is not None else None,
+		}
+		with self.lock, self.connect() as connection:
+			connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)", (key, json.dumps(fields), time.time()))
@@ -1,20 +1,106 @@
-from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QLabel, QPushButton, QScrollArea, QVBoxLayout
-from PyQt5.QtCore import Qt, QSize, QProcess
+from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QLabel, QPushButton, QScrollArea, QVBoxLayout, QTableWidget, QTableWidgetItem, QHeaderView
+from PyQt5.QtCore import Qt, QSize, QProcess, QFileSystemWatcher, QTimer
 from flowlayout import FlowLayout
-from judge import Verdict
-from outputviewer import OutputViewer, DiffViewer, FileData
-import io
+from judge import Verdict, verdict_names
+from outputviewer import OutputViewer, OutputViewerWindow, DiffViewer, FileData, read_head
+from stats import Benchmark, Headroom, HISTOGRAM_BUCKETS
+from prefetch import PREFETCH_DEPTH
+import runner
+import math
+import os
+
+# how many of the slowest tests the summary lists
+SLOWEST_SHOWN = 5
+# the width, in characters, of the histogram's longest bar
+HISTOGRAM_WIDTH = 40
+# in watch mode, how long to wait (in milliseconds) for changes to settle, as
+# saving a file or copying in tests often takes more than one write
+WATCH_DELAY = 300
+
+def format_time(seconds):
+	return str(int(seconds * 1000)) + "ms"
+
+def format_ratio(ratio):
+	return str(round(ratio * 100)) + "%"
+
+def table_item(value):
+	# numbers are stored as such, so that sorting by a column sorts them by
+	# value rather than as text
+	item = QTableWidgetItem()
+	item.setData(Qt.DisplayRole, value)
+	item.setFlags(item.flags() & ~Qt.ItemIsEditable)
+	return item
+
+def format_memory(size):
+	return "%.1fMB" % (size / 1024 / 1024)
 
 class ResultsWindow(QMainWindow):
 
-	def __init__(self, compiled_file, tests, language, time_limit, checker):
+	def __init__(self, compiled_file, tests, language, limits, checker, parallel_runs=1, spool=False, jit_probe=False, startup_time=None, benchmark_runs=None, warmup_runs=0, reuse=True, solution_path=None, fail_fast=False, searching=False, watch=False, data_path=None):
 		super().__init__()
 
 		self.compiled_file = compiled_file
-		self.tests = tests
 		self.language = language
-		self.time_limit = time_limit
+		self.limits = limits
 		self.checker = checker
+		self.parallel_runs = parallel_runs
+		self.spool = spool
+		self.jit_probe = jit_probe
+		# in seconds, the language's measured startup time, None if unknown
+		self.startup_time = startup_time
+		# with a number of runs, every test is run that many times (after the
+		# warm-up runs) and the spread of its times is reported
+		self.benchmark_runs = benchmark_runs
+		self.warmup_runs = warmup_runs
+		# whether results of identical earlier runs may stand in for running
+		# a test
+		self.reuse = reuse
+		# with the solution's path, tests it failed last time run first
+		self.solution_path = solution_path
+		# whether to stop running tests once one fails
+		self.fail_fast = fail_fast
+
+		self.tests = []
+		# whether more tests may still be added (see add_tests())
+		self.searching = searching
+		# indices into tests, in the order to run them
+		self.order = []
+		self.next_test = 0
+		self.running = 0
+		self.stopped = False
+		# while the solution is being recompiled in watch mode, no more tests
+		# are started
+		self.paused = False
+
+		# test index -> future of its run in progress
+		self.in_flight = {}
+		# how many runs each test has been given, so that the results of runs
+		# that were cancelled, or replaced by another, are recognized
+		self.runs = []
+		# input or expected output path -> index of its test
+		self.test_files = {}
+
+		# with watch mode, the solution is recompiled and rerun when it
+		# changes, and tests are rerun when their files change
+		self.data_path = data_path
+		self.watcher = None
+		if watch:
+			self.watcher = QFileSystemWatcher()
+			self.watcher.fileChanged.connect(self.file_changed)
+			self.watcher.directoryChanged.connect(self.directory_changed)
+			self.watcher.addPath(solution_path)
+			self.watcher.addPath(data_path)
+			self.watch_timer = QTimer()
+			self.watch_timer.setSingleShot(True)
+			self.watch_timer.setInterval(WATCH_DELAY)
+			self.watch_timer.timeout.connect(self.apply_changes)
+			self.solution_changed = False
+			self.changed_tests = set()
+			self.search_needed = False
+			self.compile_future = None
+			self.compiles = 0
+
+		self.headroom = Headroom(limits)
 
 		self.resize(640, 480)
 		self.setWindowTitle("Veryfire - Results")
@@ -42,122 +128,437 @@ class ResultsWindow(QMainWindow):
 		container = QWidget()
 		scroll_area.setWidget(container)
 
-		label = QLabel()
-		label.setText("Test case results:")
+		self.results_label = QLabel()
 
-		hlayout = FlowLayout()
+		self.hlayout = FlowLayout()
 
 		self.case_btns = []
 		self.case_results = []
 		self.case_statuses = []
 		self.case_vlayouts = []
-		for i in range(len(tests)):
-			case_btn = QPushButton()
-			case_btn.setText(str(i) + "    ...")
-			case_btn.setProperty("class", "caselabel")
-			case_btn.setStyleSheet("""
-				background-color: #888;
-			""")
-			hlayout.addWidget(case_btn)
-			self.case_btns.append(case_btn)
-
-			case_container = QWidget()
-
-			case_vlayout = QVBoxLayout(case_container)
-
-			case_status = QLabel(case_container)
-			case_status.setText("This case is still queued")
-			case_vlayout.addWidget(case_status)
-
-			case_vlayout.addStretch()
-
-			self.case_results.append(case_container)
-			self.case_statuses.append(case_status)
-			self.case_vlayouts.append(case_vlayout)
-
-			def get_on_click(i, btn):
-				def on_click():
-					nonlocal i, btn
-
-					if self.current_page_btn != None:
-						self.current_page_btn.setProperty("class", "caselabel")
-						self.current_page_btn.style().unpolish(self.current_page_btn)
-						self.current_page_btn.style().polish(self.current_page_btn)
-						self.current_page_btn.update()
-
-					next_page = self.case_results[i]
-					self.vlayout.replaceWidget(self.current_page, next_page)
-					self.current_page.hide()
-					next_page.show()
-					self.current_page = next_page
-
-					self.current_page_btn = btn
-					self.current_page_btn.setProperty("class", "caselabel selected")
-					self.current_page_btn.style().unpolish(self.current_page_btn)
-					self.current_page_btn.style().polish(self.current_page_btn)
-					self.current_page_btn.update()
 
-				return on_click
-
-			case_btn.clicked.connect(get_on_click(i, case_btn))
+		self.headroom_label = QLabel()
+		self.headroom_label.setTextFormat(Qt.RichText)
+		self.update_headroom()
 
 		self.vlayout = QVBoxLayout(container)
-		self.vlayout.addWidget(label)
-		self.vlayout.addLayout(hlayout)
+		if watch:
+			self.watch_label = QLabel("Watching the solution and the data directory for changes")
+			self.vlayout.addWidget(self.watch_label)
+		self.vlayout.addWidget(self.headroom_label)
+		self.vlayout.addWidget(self.results_label)
+		self.vlayout.addLayout(self.hlayout)
+
+		if benchmark_runs is not None:
+			self.benchmark_table = QTableWidget(0, 8)
+			self.benchmark_table.setHorizontalHeaderLabels(["Test", "Verdict", "Min (ms)", "Median (ms)", "P95 (ms)", "Stdev (ms)", "Runs", "Borderline"])
+			self.benchmark_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+			self.benchmark_table.verticalHeader().hide()
+			self.benchmark_table.setMinimumHeight(200)
+			self.benchmark_table.setSortingEnabled(True)
+			self.benchmark_table.sortByColumn(0, Qt.AscendingOrder)
+			self.benchmark_table.cellDoubleClicked.connect(lambda row, column: self.case_btns[self.benchmark_table.item(row, 0).data(Qt.DisplayRole)].click())
+			self.vlayout.addWidget(self.benchmark_table)
 
 		dummy = QWidget()
 		self.current_page_btn = None
 		self.current_page = dummy
 		self.vlayout.addWidget(dummy, stretch=1)
 
-		self.judge(0)
+		self.add_tests(tests)
+
+	def add_tests(self, tests):
+		# more tests may arrive while the first ones run, as the data
+		# directory is still being searched
+		failed = runner.history.failed(self.solution_path) if self.solution_path is not None else set()
+		first = []
+		rest = []
+
+		# buttons shown one by one in a visible window are laid out one by one
+		# as well, so the whole batch is shown at once instead
+		container = self.hlayout.parentWidget()
+		visible = container.isVisible()
+		if visible:
+			container.hide()
+		watched = []
+		for test in tests:
+			test_index = len(self.tests)
+			self.tests.append(test)
+			self.runs.append(0)
+			self.test_files[str(test[0])] = test_index
+			self.test_files[str(test[1])] = test_index
+			watched += [str(test[0]), str(test[1]), os.path.dirname(test[0])]
+			self.add_case(test_index)
+			self.case_btns[test_index].show()
+			if str(test[0]) in failed:
+				first.append(test_index)
+			else:
+				rest.append(test_index)
+		if visible:
+			container.show()
+
+		if self.watcher is not None and len(watched) > 0:
+			self.watcher.addPaths(list(set(watched) - set(self.watcher.directories())))
+
+		# tests the solution failed last time go before all the others that
+		# haven't started yet
+		self.order[self.next_test:self.next_test] = first
+		self.order += rest
+		if self.stopped:
+			self.skip(first + rest)
+
+		self.update_results_label()
+		self.schedule()
+
+	def finish_search(self):
+		self.searching = False
+		self.update_results_label()
+
+	def update_results_label(self):
+		if self.searching:
+			self.results_label.setText("Test case results (" + str(len(self.tests)) + " found so far, still looking for more):")
+		else:
+			self.results_label.setText("Test case results:")
+
+	def add_case(self, i):
+		case_btn = QPushButton()
+		case_btn.setText(str(i) + "    ...")
+		case_btn.setProperty("class", "caselabel")
+		case_btn.setStyleSheet("""
+			background-color: #888;
+		""")
+		self.hlayout.addWidget(case_btn)
+		self.case_btns.append(case_btn)
+
+		case_container = QWidget()
+
+		case_vlayout = QVBoxLayout(case_container)
+
+		case_status = QLabel(case_container)
+		case_status.setText("This case is still queued")
+		case_vlayout.addWidget(case_status)
+
+		case_vlayout.addStretch()
+
+		self.case_results.append(case_container)
+		self.case_statuses.append(case_status)
+		self.case_vlayouts.append(case_vlayout)
+
+		def get_on_click(i, btn):
+			def on_click():
+				nonlocal i, btn
+
+				if self.current_page_btn != None:
+					self.current_page_btn.setProperty("class", "caselabel")
+					self.current_page_btn.style().unpolish(self.current_page_btn)
+					self.current_page_btn.style().polish(self.current_page_btn)
+					self.current_page_btn.update()
+
+				next_page = self.case_results[i]
+				self.vlayout.replaceWidget(self.current_page, next_page)
+				self.current_page.hide()
+				next_page.show()
+				self.current_page = next_page
+
+				self.current_page_btn = btn
+				self.current_page_btn.setProperty("class", "caselabel selected")
+				self.current_page_btn.style().unpolish(self.current_page_btn)
+				self.current_page_btn.style().polish(self.current_page_btn)
+				self.current_page_btn.update()
+
+			return on_click
+
+		case_btn.clicked.connect(get_on_click(i, case_btn))
+
+	def schedule(self):
+		while not self.stopped and not self.paused and self.running < self.parallel_runs and self.next_test < len(self.order):
+			self.running += 1
+			self.next_test += 1
+			self.judge(self.order[self.next_test - 1])
+
+		# the files of the tests up next are read while these run
+		if not self.stopped and not self.paused:
+			runner.prefetch([self.tests[i] for i in self.order[self.next_test:self.next_test + PREFETCH_DEPTH]])
+
+	def stop(self):
+		# tests already running still finish
+		self.stopped = True
+		self.skip(self.order[self.next_test:])
+
+	def skip(self, test_indices):
+		for test_index in test_indices:
+			self.case_btns[test_index].setText(str(test_index) + "    skipped")
+			self.case_statuses[test_index].setText("This case was skipped, since an earlier one failed")
 
 	def judge(self, test_index):
 		test = self.tests[test_index]
 
 		self.case_statuses[test_index].setText("This case is currently being executed")
 
-		with io.open(test[0], "r") as file:
-			input_data = file.read()
+		self.runs[test_index] += 1
+		run = self.runs[test_index]
+
+		def callback(result):
+			if self.runs[test_index] != run:
+				return
+			del self.in_flight[test_index]
 
-		with io.open(test[1], "r") as file:
-			expected_output_data = file.read()
+			benchmark = None
+			if self.benchmark_runs is not None:
+				benchmark = Benchmark(result, self.limits)
+				result = benchmark.result()
+				self.add_benchmark_row(test_index, result.verdict, benchmark)
 
-		def callback(verdict, output_data, time_taken):
+			verdict = result.verdict
+			output_data = result.output
+
+			if self.solution_path is not None:
+				runner.history.record(self.solution_path, test, verdict)
+			if self.fail_fast and verdict != Verdict.ACCEPTED and not self.stopped:
+				self.stop()
+
+			if verdict == Verdict.TIME_LIMIT:
+				time_taken = ">" + format_time(self.limits.time_limit)
+			else:
+				time_taken = format_time(result.time_taken)
+				if self.startup_time is not None:
+					time_taken += " (" + format_time(max(result.time_taken - self.startup_time, 0)) + " without startup)"
+
+			time_taken += " (user " + format_time(result.user_time)
+			time_taken += ", system " + format_time(result.system_time)
+			time_taken += ", wall " + format_time(result.wall_time) + ")"
+
+			memory_used = format_memory(result.peak_memory)
+			if not result.peak_memory_exact:
+				memory_used = "at most " + memory_used
+
+			verdict_str = verdict_names[verdict]
+
+			# the times of tests that failed otherwise say little about how
+			# close the solution is to the time limit
+			typical_time = benchmark.summary.median if benchmark is not None else result.time_taken
+			if verdict in (Verdict.ACCEPTED, Verdict.TIME_LIMIT):
+				self.headroom.add(test_index, typical_time, verdict == Verdict.TIME_LIMIT)
+				self.update_headroom()
 			if verdict == Verdict.ACCEPTED:
-				if not self.checker.check(expected_output_data, output_data):
-					verdict = Verdict.WRONG_ANSWER
-
-			match verdict:
-				case Verdict.ACCEPTED:
-					verdict_str = "PASS"
-				case Verdict.WRONG_ANSWER:
-					verdict_str = "WA"
-				case Verdict.TIME_LIMIT:
-					verdict_str = "TLE"
-				case Verdict.MEMORY_LIMIT:
-					verdict_str = "MLE"
-				case Verdict.RUNTIME_ERROR:
-					verdict_str = "RTE"
+				verdict_str += "    " + format_ratio(self.headroom.ratio(typical_time))
+
+			if result.cached:
+				verdict_str += "    (cached)"
 
 			case_btn = self.case_btns[test_index]
 			case_btn.setText(str(test_index) + "    " + verdict_str)
-			if verdict == Verdict.ACCEPTED:
+			if verdict == Verdict.ACCEPTED and benchmark is not None and benchmark.borderline:
+				case_btn.setStyleSheet("background-color: #e80;")
+			elif verdict == Verdict.ACCEPTED:
 				case_btn.setStyleSheet("background-color: #0c0;")
 			else:
 				case_btn.setStyleSheet("background-color: #c00;")
 
-			self.case_statuses[test_index].setText("Time taken: " + time_taken)
+			status = "Time taken: " + time_taken + "    Peak memory: " + memory_used
+			if result.cold_time is not None:
+				status += "    JIT: cold " + format_time(result.cold_time) + ", warm " + format_time(result.warm_time)
+			if benchmark is not None:
+				summary = benchmark.summary
+				status += "\nOver " + str(summary.runs) + (" run" if summary.runs == 1 else " runs") + ": min " + format_time(summary.min) + ", median " + format_time(summary.median)
+				status += ", p95 " + format_time(summary.p95) + ", stdev " + format_time(summary.stdev)
+				if benchmark.borderline:
+					status += "\nThe times are close enough to the time limit that this test might pass or run out of time from one run to the next"
+			if result.mismatch is not None:
+				status += "\nFirst difference at " + result.mismatch.describe()
+			if result.cached:
+				status += "\nThis is the result of an earlier run of the same program on the same test"
+			self.case_statuses[test_index].setText(status)
 
 			if verdict == Verdict.RUNTIME_ERROR:
 				stderr_file = FileData("stderr", "Standard error", output_data, ansi=False)
 				self.case_vlayouts[test_index].addWidget(OutputViewer(stderr_file), stretch=1)
-			elif output_data != None:
-				expected_file = FileData("expected.out", "Expected output", expected_output_data, ansi=False)
-				user_file = FileData("user.out", "User output", output_data, ansi=False)
-				self.case_vlayouts[test_index].addWidget(DiffViewer(expected_file, user_file), stretch=1)
-
-			if test_index + 1 < len(self.tests):
-				self.judge(test_index + 1)
+			elif output_data is not None or result.output_file is not None:
+				expected_file = FileData("expected.out", "Expected output", read_head(test[1]), ansi=False, path=test[1])
+				if result.output_file is not None:
+					user_file = FileData("user.out", "User output", read_head(result.output_file), ansi=False, path=result.output_file)
+				else:
+					user_file = FileData("user.out", "User output", output_data, ansi=False)
+				self.case_vlayouts[test_index].addWidget(DiffViewer(expected_file, user_file, result.mismatch), stretch=1)
+
+			self.running -= 1
+			self.schedule()
+			if self.running == 0:
+				runner.history.flush()
+
+		if self.benchmark_runs is not None:
+			self.in_flight[test_index] = runner.benchmark(self.language, self.compiled_file, test[0], self.limits, callback, self.benchmark_runs, warmup_runs=self.warmup_runs, start_check=lambda: self.checker.start(test[1]), spool=self.spool)
+		else:
+			self.in_flight[test_index] = runner.judge(self.language, self.compiled_file, test, self.limits, self.checker, callback, spool=self.spool, jit_probe=self.jit_probe, reuse=self.reuse)
+
+	def cancel(self, test_index):
+		# kills the test's run, if it's running, and forgets about it
+		future = self.in_flight.pop(test_index, None)
+		if future is not None:
+			future.cancel()
+			self.runs[test_index] += 1
+			self.running -= 1
+
+	def reset_case(self, test_index):
+		self.case_btns[test_index].setText(str(test_index) + "    ...")
+		self.case_btns[test_index].setStyleSheet("background-color: #888;")
+		self.case_statuses[test_index].setText("This case is still queued")
+
+		# the status and the stretch below it stay, output viewers go
+		case_vlayout = self.case_vlayouts[test_index]
+		while case_vlayout.count() > 2:
+			case_vlayout.takeAt(2).widget().deleteLater()
+
+		self.headroom.remove(test_index)
+		if self.benchmark_runs is not None:
+			for row in range(self.benchmark_table.rowCount()):
+				if self.benchmark_table.item(row, 0).data(Qt.DisplayRole) == test_index:
+					self.benchmark_table.removeRow(row)
+					break
+
+	def restart(self, compiled_file):
+		# runs every test again, on a newly compiled solution
+		self.compiled_file = compiled_file
+		for test_index in list(self.in_flight):
+			self.cancel(test_index)
+		for test_index in range(len(self.tests)):
+			self.reset_case(test_index)
+		self.update_headroom()
+
+		if self.solution_path is not None:
+			self.order = runner.history.order(self.solution_path, self.tests)
+		else:
+			self.order = list(range(len(self.tests)))
+		self.next_test = 0
+		self.stopped = False
+		self.paused = False
+		self.schedule()
+
+	def rerun(self, test_index):
+		self.cancel(test_index)
+		self.reset_case(test_index)
+		self.update_headroom()
+
+		# tests skipped after a failure get their turn too, since the failure
+		# may have been in the test itself
+		if self.stopped:
+			self.stopped = False
+			for skipped_index in self.order[self.next_test:]:
+				self.reset_case(skipped_index)
+
+		if test_index not in self.order[self.next_test:]:
+			self.order.insert(self.next_test, test_index)
+		self.schedule()
+
+	def file_changed(self, path):
+		# editors that save by replacing the file take it out of the watch
+		if os.path.exists(path):
+			self.watcher.addPath(path)
+
+		if path == self.solution_path:
+			# whatever is running is about to be out of date
+			self.solution_changed = True
+			self.paused = True
+			for test_index in list(self.in_flight):
+				self.cancel(test_index)
+		elif path in self.test_files:
+			self.changed_tests.add(self.test_files[path])
+			self.cancel(self.test_files[path])
+		self.watch_timer.start()
+
+	def directory_changed(self, path):
+		self.search_needed = True
+		self.watch_timer.start()
+
+	def apply_changes(self):
+		if self.solution_changed:
+			self.solution_changed = False
+			self.changed_tests.clear()
+			self.recompile()
+		else:
+			for test_index in sorted(self.changed_tests):
+				self.rerun(test_index)
+			self.changed_tests.clear()
+
+		if self.search_needed:
+			self.search_needed = False
+			runner.discover(self.data_path, self.add_new_tests, lambda error: None)
+
+	def add_new_tests(self, tests):
+		self.add_tests([test for test in tests if str(test[0]) not in self.test_files])
+
+	def recompile(self):
+		if self.compile_future is not None:
+			self.compile_future.cancel()
+		self.compiles += 1
+		compile = self.compiles
+
+		self.watch_label.setText("The solution changed, compiling...")
+
+		def compile_callback(success, output, cmd):
+			if self.compiles != compile:
+				return
+			self.compile_future = None
+			if not success:
+				self.watch_label.setText("The solution failed to compile, waiting for it to change again")
+				self.viewer = OutputViewerWindow(FileData("stderr", cmd, output, ansi=True))
+				self.viewer.show()
+				return
+			self.watch_label.setText("Watching the solution and the data directory for changes")
+			self.restart(output)
+
+		self.compile_future = runner.compile(self.language, self.solution_path, compile_callback)
+
+	def closeEvent(self, event):
+		if self.watcher is not None:
+			self.watch_timer.stop()
+			self.watcher.deleteLater()
+			self.watcher = None
+			if self.compile_future is not None:
+				self.compile_future.cancel()
+			self.compiles += 1
+		for test_index in list(self.in_flight):
+			self.cancel(test_index)
+		runner.history.flush()
+		super().closeEvent(event)
+
+	def add_benchmark_row(self, test_index, verdict, benchmark):
+		summary = benchmark.summary
+		values = [
+			test_index,
+			verdict_names[verdict],
+			round(summary.min * 1000),
+			round(summary.median * 1000),
+			round(summary.p95 * 1000),
+			round(summary.stdev * 1000, 1),
+			summary.runs,
+			"yes" if benchmark.borderline else "",
+		]
+
+		# rows can't be added while the table is sorted
+		self.benchmark_table.setSortingEnabled(False)
+		row = self.benchmark_table.rowCount()
+		self.benchmark_table.insertRow(row)
+		for column, value in enumerate(values):
+			self.benchmark_table.setItem(row, column, table_item(value))
+		self.benchmark_table.setSortingEnabled(True)
+
+	def update_headroom(self):
+		slowest = []
+		for test_index, ratio in self.headroom.slowest(SLOWEST_SHOWN):
+			slowest.append(str(test_index) + " (" + (format_ratio(ratio) if ratio != math.inf else "TLE") + ")")
+		text = "Slowest tests: " + (", ".join(slowest) if len(slowest) > 0 else "none yet")
+
+		histogram = self.headroom.histogram
+		largest = max(max(histogram), 1)
+		lines = []
+		for bucket, count in enumerate(histogram):
+			if bucket < HISTOGRAM_BUCKETS:
+				name = format_ratio(bucket / HISTOGRAM_BUCKETS) + "-" + format_ratio((bucket + 1) / HISTOGRAM_BUCKETS) + " of TL"
+			else:
+				name = "TLE"
+			bar = "\u2588" * math.ceil(count / largest * HISTOGRAM_WIDTH)
+			lines.append(name.rjust(14) + " " + bar + " " + str(count))
+		text += "<pre>" + "\n".join(lines) + "</pre>"
 
-		self.language.run(self.compiled_file, input_data, self.time_limit, callback)
+		self.headroom_label.setText(text)
@@ -0,0 +1,97 @@
+from PyQt5.QtCore import QObject, Qt, pyqtSignal
+from engine import Engine
+from cache import CompileCache
+from calibration import Calibration
+from resultcache import ResultCache
+from history import History
+from caseindex import CaseIndex
+from judge import find_cases
+from prefetch import Prefetcher
+import threading
+import asyncio
+import time
+
+# Bridges the GUI to the asyncio engine: the engine's event loop runs in a
+# background thread, and results are handed back to the Qt main thread through
+# a queued signal, so callbacks are free to touch widgets.
+
+class Bridge(QObject):
+	finished = pyqtSignal(object, object)
+
+# cases found in the data directory are handed over in batches, at most this
+# many at once or after this many seconds, so that a large directory doesn't
+# flood the GUI with one signal per case
+DISCOVERY_BATCH = 256
+DISCOVERY_INTERVAL = 0.05
+
+loop = asyncio.new_event_loop()
+threading.Thread(target=loop.run_forever, daemon=True).start()
+
+# ResultsWindow decides how many tests are in flight, so the engine itself
+# doesn't impose a limit
+engine = Engine(compile_cache=CompileCache(), result_cache=ResultCache())
+
+calibration = Calibration()
+
+history = History()
+
+prefetcher = Prefetcher()
+
+bridge = Bridge()
+# queued even when emitted on the main thread, which happens when a future is
+# already done by the time submit() adds its callback (a cached result can be),
+# so callbacks never run before submit() has returned: ResultsWindow only
+# records a run as in flight, for the watch mode to cancel, once it has the
+# future
+bridge.finished.connect(lambda callback, result: callback(result), Qt.QueuedConnection)
+
+def submit(coroutine, callback):
+	future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+
+	def on_done(future):
+		if not future.cancelled():
+			bridge.finished.emit(callback, future.result())
+
+	future.add_done_callback(on_done)
+	return future
+
+def discover(data_path, cases_callback, done_callback):
+	# Searches data_path for test cases on a thread of its own, calling
+	# cases_callback with every batch found, then done_callback with None, or
+	# the OSError that cut the search short.
+	def search():
+		batch = []
+		last_batch = time.monotonic()
+		error = None
+		try:
+			for case in find_cases(data_path, CaseIndex()):
+				batch.append(case)
+				if len(batch) >= DISCOVERY_BATCH or time.monotonic() - last_batch >= DISCOVERY_INTERVAL:
+					bridge.finished.emit(cases_callback, batch)
+					batch = []
+					last_batch = time.monotonic()
+		except OSError as e:
+			error = e
+		if len(batch) > 0:
+			bridge.finished.emit(cases_callback, batch)
+		bridge.finished.emit(done_callback, error)
+
+	threading.Thread(target=search, daemon=True).start()
+
+def prefetch(tests):
+	prefetcher.prefetch(tests)
+
+def compile(language, filename, callback):
+	return submit(engine.compile(language, filename), lambda result: callback(result.success, result.output, result.cmd))
+
+def calibrate(language, callback):
+	return submit(calibration.overhead(engine, language), callback)
+
+def run(language, compiled_file, input_path, limits, callback, start_check=None, spool=False, jit_probe=False):
+	return submit(engine.run(language, compiled_file, input_path, limits, start_check=start_check, spool=spool, jit_probe=jit_probe), callback)
+
+def judge(language, compiled_file, test, limits, checker, callback, spool=False, jit_probe=False, reuse=True):
+	return submit(engine.judge(language, compiled_file, test, limits, checker, spool=spool, jit_probe=jit_probe, reuse=reuse), callback)
+
+def benchmark(language, compiled_file, input_path, limits, callback, runs, warmup_runs=0, start_check=None, spool=False):
+	return submit(engine.benchmark(language, compiled_file, input_path, limits, runs, warmup_runs=warmup_runs, start_check=start_check, spool=spool), callback)
@@ -0,0 +1,105 @@
+from judge import Verdict
+import statistics
+import bisect
+import math
+
+# Summaries of the times tests take: of a test run several times over, for
+# benchmark mode, and of all of a solution's tests, to tell how close they come
+# to the time limit. Like judge.py, this may not import PyQt5 (see cli.py).
+
+# how many standard deviations a median may be away from the time limit
+# before a test is considered to be at risk of running out of time
+BORDERLINE_STDEVS = 3
+
+# the histogram of times splits the time limit into this many buckets
+HISTOGRAM_BUCKETS = 10
+
+def percentile(values, fraction):
+	# linear interpolation between the closest ranks of the sorted values
+	position = (len(values) - 1) * fraction
+	lower = math.floor(position)
+	upper = math.ceil(position)
+	return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+class Summary:
+
+	def __init__(self, times):
+		times = sorted(times)
+		# all in seconds
+		self.runs = len(times)
+		self.min = times[0]
+		self.median = statistics.median(times)
+		self.p95 = percentile(times, 0.95)
+		self.stdev = statistics.stdev(times) if len(times) > 1 else 0
+
+class Benchmark:
+
+	def __init__(self, results, limits):
+		# the runs that were measured, warm-ups left out
+		self.results = results
+		self.summary = Summary([result.time_taken for result in results])
+
+		timed_out = [result.verdict == Verdict.TIME_LIMIT for result in results]
+		# whether the test might pass on one run and run out of time on the
+		# next: either it already did, or its times are spread widely enough
+		# to reach the time limit. Runs that time out are cut short, so their
+		# times say nothing about how far off the limit they are.
+		if any(timed_out):
+			self.borderline = not all(timed_out)
+		else:
+			self.borderline = limits.exceeded(self.summary.median + self.summary.stdev * BORDERLINE_STDEVS)
+
+	def result(self):
+		# the run to show the verdict and output of: the first that timed
+		# out, if any, otherwise the last, which is the one that failed if
+		# one did
+		for result in self.results:
+			if result.verdict == Verdict.TIME_LIMIT:
+				return result
+		return self.results[-1]
+
+class Headroom:
+
+	# How close the tests come to the time limit, updated one test at a time
+	# as their results come in.
+
+	def __init__(self, limits):
+		self.limits = limits
+		# (-fraction of the time limit, test index), so slowest first
+		self.times = []
+		# the number of tests by how much of the time limit they took, in equal
+		# steps, with one more bucket at the end for those that ran out of time
+		self.histogram = [0] * (HISTOGRAM_BUCKETS + 1)
+		# test index -> (fraction of the time limit, histogram bucket)
+		self.tests = {}
+
+	def ratio(self, time_taken):
+		# the fraction of the time limit taken, which like the time limit
+		# itself may leave out the startup time
+		if self.limits.time_limit <= 0:
+			return math.inf
+		return max(time_taken - self.limits.startup_time, 0) / self.limits.time_limit
+
+	def add(self, test_index, time_taken, timed_out):
+		# a test run again replaces its earlier time
+		self.remove(test_index)
+
+		# runs that time out are cut short, so how long they took says little
+		ratio = math.inf if timed_out else self.ratio(time_taken)
+		if timed_out:
+			bucket = HISTOGRAM_BUCKETS
+		else:
+			bucket = min(int(ratio * HISTOGRAM_BUCKETS), HISTOGRAM_BUCKETS - 1)
+		bisect.insort(self.times, (-ratio, test_index))
+		self.histogram[bucket] += 1
+		self.tests[test_index] = (ratio, bucket)
+
+	def remove(self, test_index):
+		if test_index in self.tests:
+			ratio, bucket = self.tests.pop(test_index)
+			self.times.remove((-ratio, test_index))
+			self.histogram[bucket] -= 1
+
+	def slowest(self, count):
+		# [(test index, fraction of the time limit)], slowest first
+		return [(test_index, -ratio) for ratio, test_index in self.times[:count]]